@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import websockets
+
+# Нагрузочная проверка /ws/chat/{chat_id}: задержка рассылки (от отправки сообщения до его
+# получения слушателями) при растущем числе одновременных писателей. Обработка сообщений
+# не блокирует цикл событий, поэтому задержка не должна заметно расти вместе с писателями.
+# Токены перебираются по кругу; все пользователи должны быть участниками чата. Сообщения
+# остаются в истории, поэтому запускать стоит на отдельном тестовом чате.
+# Запуск: docker compose exec chat python bench_ws.py --token ... --token ... --chat-id 1
+
+MARKER = "bench_ws"
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def socket_url(args, index):
+    token = args.token[index % len(args.token)]
+    return f"{args.url}/ws/chat/{args.chat_id}?token={token}"
+
+
+async def listen(websocket, latencies, stop):
+    while not stop.is_set():
+        try:
+            frame = await asyncio.wait_for(websocket.recv(), timeout=0.5)
+        except asyncio.TimeoutError:
+            continue
+        content = json.loads(frame).get("content") or ""
+        if content.startswith(MARKER + ":"):
+            latencies.append(time.monotonic() - float(content.split(":")[1]))
+
+
+async def write(websocket, args):
+    for _ in range(args.messages):
+        await websocket.send(json.dumps({"content": f"{MARKER}:{time.monotonic()}"}))
+        await asyncio.sleep(args.interval)
+
+
+async def run_step(args, writers):
+    latencies, stop = [], asyncio.Event()
+    readers = [await websockets.connect(socket_url(args, i)) for i in range(args.readers)]
+    senders = [await websockets.connect(socket_url(args, args.readers + i)) for i in range(writers)]
+    listeners = [asyncio.create_task(listen(ws, latencies, stop)) for ws in readers]
+    try:
+        started = time.monotonic()
+        await asyncio.gather(*(write(ws, args) for ws in senders))
+        await asyncio.sleep(args.drain)  # дожидаемся последних кадров
+        elapsed = time.monotonic() - started
+    finally:
+        stop.set()
+        await asyncio.gather(*listeners)
+        for ws in readers + senders:
+            await ws.close()
+
+    expected = writers * args.messages * args.readers
+    if not latencies:
+        print(f"{writers} writers: no frames received")
+        return
+    print(
+        f"{writers} writers: {writers * args.messages / elapsed:.1f} msg/s, delivered {len(latencies)}/{expected}, "
+        f"p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+    )
+
+
+async def run(args):
+    for writers in (int(value) for value in args.writers.split(",")):
+        await run_step(args, writers)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://localhost:8001")
+    parser.add_argument("--token", action="append", required=True, help="можно указать несколько раз")
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--readers", type=int, default=20)
+    parser.add_argument("--writers", default="1,8,32", help="число писателей на каждом шаге")
+    parser.add_argument("--messages", type=int, default=50, help="сообщений на писателя")
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--drain", type=float, default=2.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+import asyncio
+import uuid
+import asyncpg
+
+# Брокер рассылки между процессами chat-сервиса. broadcast публикует сообщение
+# в канал комнаты, каждый воркер получает его и отправляет своим локальным сокетам.
+
+MessageHandler = Callable[[str, str], Awaitable[None]]
+ReconnectHandler = Callable[[], Awaitable[None]]
+
+
+class InMemoryBroker:
+    """Брокер в пределах одного процесса (для тестов и запуска в один воркер)."""
+
+    def __init__(self):
+        self.handler: MessageHandler = None
+        self.channels: Set[str] = set()
+
+    async def start(self, handler: MessageHandler, on_reconnect: ReconnectHandler = None):
+        self.handler = handler
+
+    async def stop(self):
+        self.channels.clear()
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+    async def publish(self, channel: str, message: str):
+        if channel in self.channels:
+            await self.handler(channel, message)
+
+    async def publish_many(self, messages: List[Tuple[str, str]]):
+        for channel, message in messages:
+            await self.publish(channel, message)
+
+
+class PostgresBroker:
+    """Рассылка через LISTEN/NOTIFY: отдельный канал Postgres на каждую комнату.
+
+    Соединение LISTEN проверяется раз в HEALTH_CHECK_INTERVAL секунд; при обрыве брокер
+    переподключается с нарастающей паузой и заново подписывается на все каналы.
+    Уведомления за время обрыва теряются, поэтому после переподключения вызывается on_reconnect.
+    """
+
+    # Лимит payload у NOTIFY — 8000 байт; режем по символам с запасом на 4-байтовый UTF-8
+    CHUNK_SIZE = 1900
+    HEALTH_CHECK_INTERVAL = 10
+    HEALTH_CHECK_TIMEOUT = 5
+    RECONNECT_DELAY_MIN = 0.5
+    RECONNECT_DELAY_MAX = 30
+
+    CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.handler: MessageHandler = None
+        self.on_reconnect: ReconnectHandler = None
+        self.listen_connection: asyncpg.Connection = None
+        self.listen_lock = asyncio.Lock()  # asyncpg не допускает параллельных операций на одном соединении
+        self.connection_lost = asyncio.Event()
+        self.watchdog: asyncio.Task = None
+        self.publish_pool: asyncpg.Pool = None
+        self.channels: Set[str] = set()
+        self.pending_chunks: Dict[str, List[str]] = {}
+
+    async def start(self, handler: MessageHandler, on_reconnect: ReconnectHandler = None):
+        self.handler = handler
+        self.on_reconnect = on_reconnect
+        self.publish_pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=5)
+        async with self.listen_lock:
+            await self._connect()
+        self.watchdog = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self.watchdog:
+            self.watchdog.cancel()
+        if self.listen_connection:
+            await self.listen_connection.close()
+        if self.publish_pool:
+            await self.publish_pool.close()
+        self.channels.clear()
+
+    async def subscribe(self, channel: str):
+        async with self.listen_lock:
+            if channel in self.channels:
+                return
+            self.channels.add(channel)
+            # Пока соединения нет, канал подпишется при переподключении
+            if self.listen_connection is not None:
+                try:
+                    await self.listen_connection.add_listener(channel, self._on_notify)
+                except self.CONNECTION_ERRORS:
+                    self.connection_lost.set()
+
+    async def unsubscribe(self, channel: str):
+        async with self.listen_lock:
+            if channel not in self.channels:
+                return
+            self.channels.discard(channel)
+            if self.listen_connection is not None:
+                try:
+                    await self.listen_connection.remove_listener(channel, self._on_notify)
+                except self.CONNECTION_ERRORS:
+                    self.connection_lost.set()
+
+    async def publish(self, channel: str, message: str):
+        await self.publish_many([(channel, message)])
+
+    async def publish_many(self, messages: List[Tuple[str, str]]):
+        # Все уведомления одним запросом: порядок внутри транзакции сохраняется
+        channels, payloads = [], []
+        for channel, message in messages:
+            for payload in self._payloads(message):
+                channels.append(channel)
+                payloads.append(payload)
+        if channels:
+            await self.publish_pool.execute(
+                "SELECT pg_notify(c, p) FROM unnest($1::text[], $2::text[]) AS t(c, p)", channels, payloads
+            )
+
+    def _payloads(self, message: str) -> List[str]:
+        # id сообщения в каждом куске: одинаковые NOTIFY в одной транзакции Postgres схлопывает
+        message_id = uuid.uuid4().hex
+        chunks = [message[i:i + self.CHUNK_SIZE] for i in range(0, len(message), self.CHUNK_SIZE)] or [""]
+        return [f"{message_id}:{part}:{len(chunks)}:{chunk}" for part, chunk in enumerate(chunks)]
+
+    async def _connect(self):
+        # Вызывается под listen_lock: новое соединение слушает все текущие каналы
+        connection = await asyncpg.connect(self.dsn)
+        try:
+            for channel in self.channels:
+                await connection.add_listener(channel, self._on_notify)
+        except BaseException:
+            connection.terminate()
+            raise
+        connection.add_termination_listener(self._on_terminate)
+        self.listen_connection = connection
+
+    def _on_terminate(self, connection):
+        if connection is self.listen_connection:
+            self.connection_lost.set()
+
+    async def _watch(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.connection_lost.wait(), self.HEALTH_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                try:
+                    async with self.listen_lock:
+                        await self.listen_connection.fetchval("SELECT 1", timeout=self.HEALTH_CHECK_TIMEOUT)
+                    continue
+                except self.CONNECTION_ERRORS as e:
+                    print(f"Broker health check failed: {e}")
+            await self._reconnect()
+
+    async def _reconnect(self):
+        async with self.listen_lock:
+            connection, self.listen_connection = self.listen_connection, None
+            self.connection_lost.clear()
+            if connection is not None:
+                connection.terminate()
+
+        delay = self.RECONNECT_DELAY_MIN
+        while True:
+            try:
+                async with self.listen_lock:
+                    await self._connect()
+                break
+            except self.CONNECTION_ERRORS as e:
+                print(f"Broker reconnect failed: {e}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.RECONNECT_DELAY_MAX)
+
+        # Куски сообщений, начатых до обрыва, уже не придут
+        self.pending_chunks.clear()
+        print(f"Broker reconnected, listening on {len(self.channels)} channels")
+        if self.on_reconnect:
+            await self.on_reconnect()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        message_id, part, total, chunk = payload.split(":", 3)
+        total = int(total)
+        if total == 1:
+            message = chunk
+        else:
+            chunks = self.pending_chunks.setdefault(message_id, [None] * total)
+            chunks[int(part)] = chunk
+            if any(c is None for c in chunks):
+                return
+            del self.pending_chunks[message_id]
+            message = "".join(chunks)
+
+        asyncio.create_task(self.handler(channel, message))
@@ -1,3 +1,36 @@
+import os
+
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 240
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES = 240
+
+# Брокер рассылки между воркерами: "postgres" (LISTEN/NOTIFY) или "memory" (один процесс)
+BROKER_BACKEND = os.getenv("BROKER_BACKEND", "postgres")
+BROKER_DSN = os.getenv("BROKER_DSN", os.getenv("DATABASE_URL", "postgresql://messly_user:messly@db:5432/messlydb"))
+
+# Исходящая очередь каждого сокета: размер и поведение при переполнении ("drop_oldest" или "disconnect")
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "100"))
+SEND_QUEUE_OVERFLOW = os.getenv("SEND_QUEUE_OVERFLOW", "drop_oldest")
+SEND_QUEUE_OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+if SEND_QUEUE_OVERFLOW not in SEND_QUEUE_OVERFLOW_POLICIES:
+    # Опечатка в политике не должна молча превращаться в drop_oldest
+    raise ValueError(
+        f"SEND_QUEUE_OVERFLOW must be one of {', '.join(SEND_QUEUE_OVERFLOW_POLICIES)}, got {SEND_QUEUE_OVERFLOW!r}"
+    )
+
+# Кэш пользователя по id из токена (website сбрасывает свой кэш при изменениях, здесь — только TTL)
+PRINCIPAL_CACHE_TTL = 60  # секунд
+PRINCIPAL_CACHE_SIZE = 10000
+
+# Окно накопления отметок о прочтении по комнате перед одной пачкой (UPDATE + кадр)
+READ_RECEIPTS_WINDOW_MS = int(os.getenv("READ_RECEIPTS_WINDOW_MS", "75"))
+
+# Общий с website токен для внутренних вызовов (/internal/...), заголовок X-Internal-Token.
+# Значения по умолчанию нет: известный токен открыл бы внутренние эндпоинты кому угодно
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN", "")
+if not INTERNAL_API_TOKEN:
+    raise RuntimeError("INTERNAL_API_TOKEN is not set")
+
+# Кэш участников чатов (website сбрасывает записи при изменении состава, TTL — страховка)
+MEMBERSHIP_CACHE_TTL = 300  # секунд
+MEMBERSHIP_CACHE_SIZE = 10000
\ No newline at end of file
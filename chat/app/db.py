@@ -1,21 +1,33 @@
-from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-import time
+from db_settings import DATABASE_URL, engine_options, asyncpg_connect_args, backoff_delays
+import asyncio
 
-time.sleep(5)
+# asyncpg: запросы из WebSocket-обработчиков не блокируют event loop
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-DATABASE_URL = "postgresql://messly_user:messly@db:5432/messlydb"
+engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=asyncpg_connect_args(), **engine_options())
 
-engine = create_engine(DATABASE_URL)
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: после commit атрибуты читаются без неявного (синхронного) refresh
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db_session = SessionLocal()
-    try:
-        yield db_session
-    finally:
-        db_session.close()
\ No newline at end of file
+async def wait_for_database():
+    # Пробуем подключиться с экспоненциальной задержкой, пока БД не станет доступна
+    for delay in backoff_delays():
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+            return
+        except (OperationalError, OSError) as e:
+            print(f"Database is not ready, retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+async def get_db():
+    async with SessionLocal() as db_session:
+        yield db_session
\ No newline at end of file
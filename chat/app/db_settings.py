@@ -0,0 +1,64 @@
+import os
+import time
+
+# Настройки подключения к БД из окружения (docker-compose), чтобы пул можно было
+# подбирать под каждую реплику без пересборки образа
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://messly_user:messly@db:5432/messlydb")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # секунд ожидания свободного соединения
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # секунд до пересоздания соединения
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "messly")
+
+# Ожидание готовности БД при старте: экспоненциальная задержка вместо фиксированного sleep
+DB_READY_TIMEOUT = float(os.getenv("DB_READY_TIMEOUT", "60"))
+DB_READY_INITIAL_DELAY = 0.1
+DB_READY_MAX_DELAY = 5.0
+
+
+def engine_options():
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def psycopg2_connect_args():
+    return {
+        "application_name": DB_APPLICATION_NAME,
+        "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+    }
+
+
+def asyncpg_connect_args():
+    return {
+        "server_settings": {
+            "application_name": DB_APPLICATION_NAME,
+            "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+        }
+    }
+
+
+def backoff_delays():
+    """Задержки между попытками подключения, пока не истечёт DB_READY_TIMEOUT."""
+    deadline = time.monotonic() + DB_READY_TIMEOUT
+    delay = DB_READY_INITIAL_DELAY
+    while time.monotonic() + delay < deadline:
+        yield delay
+        delay = min(delay * 2, DB_READY_MAX_DELAY)
+
+
+def pool_stats(pool):
+    return {
+        "pool_size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
@@ -1,20 +1,32 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException, Header
 from jose import jwt
-from sqlalchemy.orm import Session
-from db import get_db
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from db import get_db, SessionLocal, engine, wait_for_database
+from db_settings import pool_stats
 from models import *
 from websocket_manager import ConnectionManager
-from config import SECRET_KEY, ALGORITHM
+from broker import InMemoryBroker, PostgresBroker
+from summaries import record_message, advance_read_cursors, refresh_chat_summary
+from read_receipts import ReadReceiptBuffer
+from config import SECRET_KEY, ALGORITHM, BROKER_BACKEND, BROKER_DSN, PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_SIZE, \
+    READ_RECEIPTS_WINDOW_MS, MEMBERSHIP_CACHE_TTL, MEMBERSHIP_CACHE_SIZE, INTERNAL_API_TOKEN
+from principal_cache import Principal, PrincipalCache
+from membership_cache import MembershipCache
+from previews import preview_payload
+from signed_urls import sign_file_url, sign_preview, verify_upload
+from blob_refs import is_blob, is_attachment, acquire_statement, release_statement
 from datetime import datetime
-import json
+from typing import Optional
+from serialization import dumps, loads, DefaultResponse
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+import hmac
 import mimetypes
 import os
 
-BASE_WEBSITE_URL = "http://website:8000"
 
-app = FastAPI()
+app = FastAPI(default_response_class=DefaultResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,212 +36,485 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешить все заголовки
 )
 
-manager = ConnectionManager()
+membership_cache = MembershipCache(ttl=MEMBERSHIP_CACHE_TTL, maxsize=MEMBERSHIP_CACHE_SIZE)
+
+principal_cache = PrincipalCache(ttl=PRINCIPAL_CACHE_TTL, maxsize=PRINCIPAL_CACHE_SIZE)
+
+if BROKER_BACKEND == "memory":
+    manager = ConnectionManager(InMemoryBroker(), membership_cache, principal_cache)
+else:
+    manager = ConnectionManager(PostgresBroker(BROKER_DSN), membership_cache, principal_cache)
+
+
+@app.on_event("startup")
+async def startup():
+    await wait_for_database()
+    await manager.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await receipt_buffer.stop()
+    await manager.stop()
+
 
 # Валидация токена и получение данных пользователя
-def get_current_user_from_token(token: str, db: Session):
+async def get_current_user_from_token(token: str, db: AsyncSession) -> Principal:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
+        user_id = payload.get("uid")
         if email is None:
             raise HTTPException(status_code=403, detail="Invalid token")
 
-        user = db.query(User).filter(User.email == email).first()
-        if not user:
+        # Токен содержит id пользователя: при попадании в кэш запрос к БД не нужен
+        if user_id is not None:
+            principal = await load_principal(db, user_id)
+        else:
+            # Старые токены без uid
+            user = (await db.execute(select(User).where(User.email == email))).scalars().first()
+            principal = Principal.from_user(user) if user else None
+            if principal:
+                principal_cache.set(principal)
+        if not principal:
             raise HTTPException(status_code=404, detail="User not found")
-
-        return user
+        return principal
     except jwt.JWTError:
         raise HTTPException(status_code=403, detail="Invalid token")
 
 
-@app.websocket("/ws/chat/{chat_id}")
-async def websocket_chat(websocket: WebSocket, chat_id: int, token: str = Query(...), db: Session = Depends(get_db)):
-    user = get_current_user_from_token(token, db)
+# Данные пользователя по id: из кэша (website сбрасывает запись при изменении) или из БД
+async def load_principal(db: AsyncSession, user_id: int) -> Optional[Principal]:
+    principal = principal_cache.get(user_id)
+    if principal:
+        return principal
+    user = await db.get(User, user_id)
+    if not user:
+        return None
+    principal = Principal.from_user(user)
+    principal_cache.set(principal)
+    return principal
+
+
+# Рассылка участникам чата обновлённой строки списка чатов (последнее сообщение и непрочитанные)
+async def notify_chat_list(db: AsyncSession, chat_id: int):
+    members = (await db.execute(
+        select(ChatMember.user_id, ChatMember.unread_count).where(ChatMember.chat_id == chat_id)
+    )).all()
+    if not members:
+        return
+
+    summary = (await db.execute(
+        select(ChatSummary)
+        .where(ChatSummary.chat_id == chat_id)
+        .options(joinedload(ChatSummary.last_sender))
+    )).scalars().first()
+    if summary and summary.last_message_id is not None:
+        last_message = {
+            "id": summary.last_message_id,
+            "content": summary.last_message_preview,
+            "sender_id": summary.last_sender_id,
+            "sender_name": summary.last_sender.username if summary.last_sender else None,
+            "sent_at": summary.last_sent_at.isoformat() if summary.last_sent_at else None,
+            "status": summary.last_message_status,
+        }
+    else:
+        last_message = None
+
+    # Одним запросом к брокеру: событие в канал каждого участника
+    await manager.send_to_users({
+        user_id: dumps({
+            "type": "chat_update",
+            "chat_id": chat_id,
+            "last_message": last_message,
+            "unread_count": unread_count,
+        })
+        for user_id, unread_count in members
+    })
+
+
+@app.websocket("/ws/user")
+async def websocket_user_events(websocket: WebSocket, token: str = Query(...)):
+    # Поток событий списка чатов вместо периодического опроса /chats/
+    # Сессия нужна только для проверки токена, соединение с БД сразу возвращается в пул
+    async with SessionLocal() as db:
+        user = await get_current_user_from_token(token, db)
     if not user:
         await websocket.close(code=1008)
         return
 
+    await websocket.accept()
+    await manager.connect_user(websocket, user.id)
+
+    try:
+        while True:
+            await websocket.receive_text()  # Клиент ничего не отправляет, ждём отключения
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Очередь отправки и подписка освобождаются при любом выходе, в том числе по ошибке
+        await manager.disconnect_user(websocket, user.id)
+
+
+@app.websocket("/ws/chat/{chat_id}")
+async def websocket_chat(websocket: WebSocket, chat_id: int, token: str = Query(...)):
+    # Сессия открывается только на время обработки события, а не на всё время жизни сокета,
+    # поэтому простаивающие соединения не держат подключения к БД
+    async with SessionLocal() as db:
+        user = await get_current_user_from_token(token, db)
+        is_member = user is not None and await membership_cache.is_member(db, chat_id, user.id)
+    if not is_member:
+        await websocket.close(code=1008)
+        return
+
     await websocket.accept()  # Подключаем WebSocket клиента
     await manager.connect(websocket, str(chat_id), user.id)
 
     try:
-        # Помечаем сообщения как прочитанные, если отправитель не текущий пользователь
-        unread_messages = db.query(Message).filter(
-            Message.chat_id == chat_id,
-            Message.status == "unread",
-            Message.sender_id != user.id
-        ).all()
-
-        for message in unread_messages:
-            message.status = "read"
-        db.commit()
-
-        if unread_messages:
-            await manager.broadcast(
-                json.dumps({
-                    "type": "read_receipts",
-                    "read_message_ids": [msg.id for msg in unread_messages]
-                }),
-                str(chat_id)
-            )
+        async with SessionLocal() as db:
+            await mark_chat_read(db, chat_id, user.id)
 
         while True:
-            data = await websocket.receive_text()
-            parsed_data = json.loads(data)
+            parsed_data = parse_frame(await websocket.receive_text())
+            if parsed_data is None:
+                # Некорректный кадр отклоняется, сокет остаётся открытым
+                await websocket.send_text(dumps({"type": "error", "detail": "Malformed frame"}))
+                continue
+
+            # Участника могли удалить из чата, а пользователя — переименовать или удалить,
+            # пока сокет открыт: данные берутся из кэшей, которые website сбрасывает
+            async with SessionLocal() as db:
+                principal = await load_principal(db, user.id)
+                if not principal or not await membership_cache.is_member(db, chat_id, user.id):
+                    await websocket.close(code=1008)
+                    return
+                user = principal
+
+            if parsed_data.get("type") == "read_receipts":
+                # Клиент дочитал историю до конца
+                async with SessionLocal() as db:
+                    await mark_chat_read(db, chat_id, user.id, parsed_data.get("last_read_message_id"))
 
             if parsed_data.get("content"):
-                # Новое сообщение
-                sent_at = datetime.utcnow()
-                new_message = Message(
-                    content=parsed_data["content"],
-                    sender_id=user.id,
-                    chat_id=chat_id,
-                    sent_at=sent_at,
-                    status="unread"
-                )
-                db.add(new_message)
-                db.commit()
-
-                # Проверяем наличие других активных пользователей
-                active_users = manager.get_active_users(str(chat_id))
-                if len(active_users) > 1:  # Если есть другие пользователи
-                    new_message.status = "read"
-                    db.commit()
-                    await manager.broadcast(
-                        json.dumps({
-                            "type": "read_receipts",
-                            "read_message_ids": [new_message.id]
-                        }),
-                        str(chat_id)
-                    )
-
-                response = {
-                    "id": new_message.id,
-                    "content": new_message.content,
-                    "author": user.username,
-                    "author_avatar": user.profile_picture or "static/avatars/default.png",  # Добавляем URL аватарки
-                    "sent_at": sent_at.isoformat(),
-                    "status": new_message.status
-                }
-
-                await manager.broadcast(json.dumps(response), str(chat_id))
+                async with SessionLocal() as db:
+                    await handle_text_message(db, user, chat_id, parsed_data["content"])
 
             if parsed_data.get("file_url"):
-                # Сообщение с файлом
-                sent_at = datetime.utcnow()
-                new_message = Message(
-                    file_url=parsed_data["file_url"],
-                    sender_id=user.id,
-                    chat_id=chat_id,
-                    sent_at=sent_at,
-                    status="unread",
-                )
-                db.add(new_message)
-                db.commit()
-
-                mime_type, _ = mimetypes.guess_type(parsed_data["file_url"])
-                is_image = mime_type and mime_type.startswith("image/")
-
-                active_users = manager.get_active_users(str(chat_id))
-                if len(active_users) > 1:  # Если есть другие пользователи
-                    new_message.status = "read"
-                    db.commit()
-                    await manager.broadcast(
-                        json.dumps({
-                            "type": "read_receipts",
-                            "read_message_ids": [new_message.id]
-                        }),
-                        str(chat_id)
-                    )
-
-                response = {
-                    "id": new_message.id,
-                    "file_url": new_message.file_url,
-                    "filename": os.path.basename(new_message.file_url).split("_", 3)[-1],
-                    "is_image": is_image,
-                    "author": user.username,
-                    "author_avatar": user.profile_picture or "static/avatars/default.png",
-                    "sent_at": sent_at.isoformat(),
-                    "status": new_message.status,
-                }
-
-                await manager.broadcast(json.dumps(response), str(chat_id))
+                async with SessionLocal() as db:
+                    if not await handle_file_message(
+                        db, user, chat_id, parsed_data["file_url"], parsed_data.get("upload_token"), parsed_data.get("file_name")
+                    ):
+                        await websocket.send_text(dumps({"type": "error", "detail": "File not found"}))
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, str(chat_id), user.id)
+        pass
+    finally:
+        # Очередь отправки, комната и подписка освобождаются при любом выходе, в том числе по ошибке
+        await manager.disconnect(websocket, str(chat_id), user.id)
 
 
+# Поля кадра клиента и их допустимые типы
+FRAME_FIELDS = {
+    "type": str,
+    "content": str,
+    "file_url": str,
+    "file_name": str,
+    "upload_token": str,
+    "last_read_message_id": int,
+}
 
 
+def parse_frame(data: str):
+    """Кадр клиента как dict или None, если это не JSON-объект или у поля неверный тип."""
+    try:
+        frame = loads(data)
+    except ValueError:
+        return None
+    if not isinstance(frame, dict):
+        return None
+    for field, field_type in FRAME_FIELDS.items():
+        value = frame.get(field)
+        if value is not None and (not isinstance(value, field_type) or isinstance(value, bool)):
+            return None
+    return frame
+
+
+def read_receipts_frame(chat_id: int, cursors: dict) -> str:
+    # Вместо списков id сообщений — курсоры прочтения участников
+    return dumps({
+        "type": "read_receipts",
+        "chat_id": chat_id,
+        "readers": [
+            {"user_id": user_id, "last_read_message_id": message_id}
+            for user_id, message_id in cursors.items()
+        ],
+    })
+
+
+# Сдвигает курсор прочтения участника на последнее сообщение чата (через буфер отметок)
+async def mark_chat_read(db: AsyncSession, chat_id: int, user_id: int, up_to: int = None):
+    last_message_id = (await db.execute(
+        select(ChatSummary.last_message_id).where(ChatSummary.chat_id == chat_id)
+    )).scalar()
+    if last_message_id is None:
+        return
+    # Клиент сообщает новейшее увиденное сообщение; курсор не уходит дальше него
+    if isinstance(up_to, int):
+        last_message_id = min(last_message_id, up_to)
+    receipt_buffer.add(chat_id, {user_id: last_message_id})
 
-@app.post("/ws/send-system-message")
-async def send_system_message(data: dict, db: Session = Depends(get_db)):
-    chat_id = data.get("chat_id")
-    content = data.get("content")
 
-    if not chat_id or not content:
-        raise HTTPException(status_code=400, detail="chat_id and content are required")
+# Если в комнате есть другие пользователи, их курсоры сдвигаются на новое сообщение
+def mark_read_if_active(chat_id: int, new_message: Message) -> str:
+    receipt_buffer.note_message()
+    readers = [user_id for user_id in manager.get_active_users(str(chat_id)) if user_id != new_message.sender_id]
+    if not readers:
+        return "unread"
+    receipt_buffer.add(chat_id, {user_id: new_message.id for user_id in readers})
+    return "read"
+
+
+# Сброс накопленных отметок чата: одно UPDATE курсоров, один commit и один кадр
+async def flush_read_receipts(chat_id: int, cursors: dict):
+    async with SessionLocal() as db:
+        advanced = await advance_read_cursors(db, chat_id, cursors)
+        if not advanced:
+            return
+        await db.commit()
+        await manager.broadcast(read_receipts_frame(chat_id, advanced), str(chat_id))
+        await notify_chat_list(db, chat_id)
 
-    # Создаем системное сообщение в базе данных
+
+receipt_buffer = ReadReceiptBuffer(flush_read_receipts, READ_RECEIPTS_WINDOW_MS)
+
+
+async def handle_text_message(db: AsyncSession, user: Principal, chat_id: int, content: str):
+    # Новое сообщение
     sent_at = datetime.utcnow()
+    new_message = Message(
+        content=content,
+        sender_id=user.id,
+        chat_id=chat_id,
+        sent_at=sent_at,
+        status="unread"
+    )
+    db.add(new_message)
+    await record_message(db, new_message)
+    await db.commit()
+
+    status = mark_read_if_active(chat_id, new_message)
+
+    response = {
+        "id": new_message.id,
+        "content": new_message.content,
+        "sender_id": user.id,
+        "author": user.username,
+        "author_avatar": user.profile_picture or "static/avatars/default.png",  # Добавляем URL аватарки
+        "sent_at": sent_at.isoformat(),
+        "status": status
+    }
+
+    await manager.broadcast(dumps(response), str(chat_id))
+    await notify_chat_list(db, chat_id)
+
+
+async def handle_file_message(
+    db: AsyncSession, user: Principal, chat_id: int, file_url: str, upload_token: str, file_name: str = None
+) -> bool:
+    # Сообщение с файлом: ссылается только на вложение, загруженное этим пользователем в этот чат
+    # (токен загрузки от website), ссылку на него берём в той же транзакции, что и вставку сообщения
+    if not is_attachment(file_url) or not verify_upload(upload_token, file_url, chat_id, user.id):
+        return False
+    if not (await db.execute(acquire_statement(file_url))).rowcount:
+        await db.rollback()
+        return False
+
+    sent_at = datetime.utcnow()
+    new_message = Message(
+        file_url=file_url,
+        file_name=file_name,
+        sender_id=user.id,
+        chat_id=chat_id,
+        sent_at=sent_at,
+        status="unread",
+    )
+    db.add(new_message)
+    await record_message(db, new_message)
+    await db.commit()
+
+    mime_type, _ = mimetypes.guess_type(file_name or file_url)
+    is_image = mime_type and mime_type.startswith("image/")
+
+    status = mark_read_if_active(chat_id, new_message)
+
+    response = {
+        "id": new_message.id,
+        # Клиенты получают только подписанные ссылки на вложение и его миниатюры
+        "file_url": sign_file_url(new_message.file_url, chat_id),
+        "filename": file_name or os.path.basename(file_url).split("_", 3)[-1],
+        "is_image": is_image,
+        "preview": sign_preview(preview_payload(await db.get(Blob, file_url)), chat_id) if is_image else None,
+        "sender_id": user.id,
+        "author": user.username,
+        "author_avatar": user.profile_picture or "static/avatars/default.png",
+        "sent_at": sent_at.isoformat(),
+        "status": status,
+    }
+
+    await manager.broadcast(dumps(response), str(chat_id))
+    await notify_chat_list(db, chat_id)
+    return True
+
+
+async def add_system_message(db: AsyncSession, chat_id: int, content: str) -> Message:
+    # Создаем системное сообщение в базе данных (commit делает вызывающий)
     system_message = Message(
         content=content,
         sender_id=0,  # ID системного пользователя
         chat_id=chat_id,
-        sent_at=sent_at
+        sent_at=datetime.utcnow()
     )
     db.add(system_message)
-    db.commit()
+    await record_message(db, system_message)
+    return system_message
 
+
+async def broadcast_system_message(db: AsyncSession, system_message: Message):
     # Формируем сообщение для отправки
     response_message = {
         "id": system_message.id,
         "content": system_message.content,
         "author": None,
         "is_system": True,
-        "sent_at": sent_at.isoformat(),
+        "sent_at": system_message.sent_at.isoformat(),
     }
 
     # Рассылаем сообщение всем участникам
-    await manager.broadcast(json.dumps(response_message), str(chat_id))
+    await manager.broadcast(dumps(response_message), str(system_message.chat_id))
+    await notify_chat_list(db, system_message.chat_id)
+
+
+# Внутренние вызовы от website: вне /ws/ (nginx их не проксирует) и только с общим токеном,
+# потому что порт сервиса доступен не только через nginx
+def require_internal_token(x_internal_token: str = Header(None)):
+    if not x_internal_token or not hmac.compare_digest(x_internal_token, INTERNAL_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Internal endpoint")
+
+
+@app.post("/internal/send-system-message", dependencies=[Depends(require_internal_token)])
+async def send_system_message(data: dict, db: AsyncSession = Depends(get_db)):
+    chat_id = data.get("chat_id")
+    content = data.get("content")
+
+    if not chat_id or not content:
+        raise HTTPException(status_code=400, detail="chat_id and content are required")
+
+    system_message = await add_system_message(db, chat_id, content)
+    await db.commit()
+    await broadcast_system_message(db, system_message)
 
     return {"detail": "System message sent"}
 
 
+@app.post("/internal/outbox-events", dependencies=[Depends(require_internal_token)])
+async def receive_outbox_events(data: dict, db: AsyncSession = Depends(get_db)):
+    # Пачка событий из outbox website в порядке их записи. Доставка «хотя бы один раз»:
+    # при повторе пачки системное сообщение может продублироваться
+    events = data.get("events") or []
+
+    # Чат мог быть удалён, пока событие ждало отправки, — такие сообщения пропускаем
+    chat_ids = {event["payload"]["chat_id"] for event in events if event["type"] == "system_message"}
+    existing_chat_ids = set((await db.execute(
+        select(Chat.id).where(Chat.id.in_(chat_ids))
+    )).scalars().all()) if chat_ids else set()
+
+    # Все системные сообщения пачки сохраняются одной транзакцией
+    system_messages = {}
+    for event in events:
+        payload = event["payload"]
+        if event["type"] == "system_message" and payload["chat_id"] in existing_chat_ids:
+            system_messages[event["id"]] = await add_system_message(db, payload["chat_id"], payload["content"])
+    await db.commit()
+
+    for event in events:
+        payload = event["payload"]
+        if event["type"] == "membership_changed":
+            await manager.invalidate_membership(int(payload["chat_id"]))
+        elif event["type"] == "principal_changed":
+            await manager.invalidate_principal(int(payload["user_id"]))
+        elif event["type"] == "user_event":
+            message = dumps(payload["event"])
+            await manager.send_to_users({user_id: message for user_id in payload["user_ids"]})
+        elif event["id"] in system_messages:
+            await broadcast_system_message(db, system_messages[event["id"]])
+
+    return {"detail": f"{len(events)} events processed"}
+
+
+@app.post("/internal/user-event", dependencies=[Depends(require_internal_token)])
+async def send_user_event(data: dict):
+    # Внутренний вызов от website: изменения состава и названия чатов
+    user_ids = data.get("user_ids")
+    event = data.get("event")
+
+    if not user_ids or not event:
+        raise HTTPException(status_code=400, detail="user_ids and event are required")
+
+    message = dumps(event)
+    await manager.send_to_users({user_id: message for user_id in user_ids})
+
+    return {"detail": "User event sent"}
+
+
+@app.post("/internal/membership-changed", dependencies=[Depends(require_internal_token)])
+async def membership_changed(data: dict):
+    # Вызывается website после изменения состава чата; сброс расходится по всем воркерам
+    chat_id = data.get("chat_id")
+    if chat_id is None:
+        raise HTTPException(status_code=400, detail="chat_id is required")
+    await manager.invalidate_membership(int(chat_id))
+    return {"detail": "Membership cache invalidated"}
+
+
+@app.get("/internal/metrics", dependencies=[Depends(require_internal_token)])
+async def get_metrics():
+    # Подключения к БД, занятые сейчас, против открытых WebSocket-соединений
+    return {
+        "db_pool": pool_stats(engine.pool),
+        "open_sockets": manager.count_connections(),
+        **manager.get_queue_stats(),
+        "read_receipts": receipt_buffer.get_stats(),
+        "membership_cache": membership_cache.get_stats(),
+    }
+
+
 @app.delete("/ws/clear-chat-history/{chat_id}")
-async def clear_chat_history(chat_id: int, token: str = Query(...), db: Session = Depends(get_db)):
+async def clear_chat_history(chat_id: int, token: str = Query(...), db: AsyncSession = Depends(get_db)):
     # Валидация пользователя
-    user = get_current_user_from_token(token, db)
+    user = await get_current_user_from_token(token, db)
     if not user:
         raise HTTPException(status_code=403, detail="Invalid token")
 
     # Проверяем, является ли пользователь администратором чата
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
+    chat = await db.get(Chat, chat_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    if chat.creator_id != user.id:
+    if chat.creator_id != user.id or not await membership_cache.is_member(db, chat_id, user.id):
         raise HTTPException(status_code=403, detail="You are not the admin of this chat")
 
-    messages_with_files = db.query(Message).filter(Message.chat_id == chat_id, Message.file_url != None).all()
-
-    # Отправляем запросы на удаление файлов
-    for message in messages_with_files:
-        try:
-            response = requests.delete(
-                f"{BASE_WEBSITE_URL}/delete-file/",
-                params={"file_url": message.file_url},
-                headers={"Authorization": f"Bearer {token}"},  # Передаем токен для авторизации
-            )
-            if response.status_code != 200:
-                print(f"Failed to delete file: {response.text}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error connecting to website service: {str(e)}")
-
-    # Удаляем сообщения чата
-    db.query(Message).filter(Message.chat_id == chat_id).delete()
-    db.commit()
+    # Удаляем сообщения чата и в той же транзакции снимаем ссылки с их файлов
+    file_urls = (await db.execute(
+        delete(Message)
+        .where(Message.chat_id == chat_id)
+        .returning(Message.file_url)
+        .execution_options(synchronize_session=False)
+    )).scalars().all()
+    release = release_statement(*file_urls)
+    if release is not None:
+        await db.execute(release)
+    await refresh_chat_summary(db, chat_id)
+    await db.commit()
 
     # Уведомляем всех подключенных пользователей
     notification = {
@@ -238,60 +523,56 @@ async def clear_chat_history(chat_id: int, token: str = Query(...), db: Session
         "message": "Chat history has been cleared by the admin"
     }
 
-    await manager.broadcast(json.dumps(notification), str(chat_id))
+    await manager.broadcast(dumps(notification), str(chat_id))
+    await notify_chat_list(db, chat_id)
 
     return {"detail": "Chat history cleared successfully"}
 
 
 @app.delete("/ws/delete-message/{message_id}")
-async def delete_message(message_id: int, token: str = Query(...), db: Session = Depends(get_db)):
+async def delete_message(message_id: int, token: str = Query(...), db: AsyncSession = Depends(get_db)):
     # Проверяем токен
-    user = get_current_user_from_token(token, db)
+    user = await get_current_user_from_token(token, db)
     if not user:
         raise HTTPException(status_code=403, detail="Invalid token")
 
     # Проверяем существование сообщения
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db.get(Message, message_id)
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    if message.file_url:
-        try:
-            # Отправляем запрос на удаление файла
-            response = requests.delete(
-                f"{BASE_WEBSITE_URL}/delete-file/",
-                params={"file_url": message.file_url},
-                headers={"Authorization": f"Bearer {token}"},
-            )
-            if response.status_code != 200:
-                print(f"Failed to delete file: {response.text}")
-        except requests.exceptions.RequestException as e:
-            print(f"Error connecting to website service: {str(e)}")
-
     # Проверяем, имеет ли пользователь доступ к сообщению
-    chat = db.query(Chat).filter(Chat.id == message.chat_id).first()
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
-    if user.id not in [member.user_id for member in chat.members]:
+    if not await membership_cache.is_member(db, message.chat_id, user.id):
         raise HTTPException(status_code=403, detail="You are not a member of this chat")
 
-    # Удаляем сообщение
-    db.delete(message)
-    db.commit()
+    # Удаляем сообщение и в той же транзакции снимаем ссылку с его файла; путь берём
+    # из удалённой строки, а не из прочитанной раньше
+    chat_id = message.chat_id
+    file_url = (await db.execute(
+        delete(Message)
+        .where(Message.id == message_id)
+        .returning(Message.file_url)
+        .execution_options(synchronize_session=False)
+    )).scalar()
+    if is_blob(file_url):
+        await db.execute(release_statement(file_url))
+    await refresh_chat_summary(db, chat_id)
+    await db.commit()
 
     # Уведомляем участников чата
     notification = {
         "type": "message_deleted",
         "message_id": message_id,
     }
-    await manager.broadcast(json.dumps(notification), str(chat.id))
+    await manager.broadcast(dumps(notification), str(chat_id))
+    await notify_chat_list(db, chat_id)
 
     return {"detail": "Message deleted successfully"}
 
 
 @app.post("/ws/add-reaction")
-async def add_reaction(data: dict, token: str = Query(...), db: Session = Depends(get_db)):
-    user = get_current_user_from_token(token, db)
+async def add_reaction(data: dict, token: str = Query(...), db: AsyncSession = Depends(get_db)):
+    user = await get_current_user_from_token(token, db)
     if not user:
         raise HTTPException(status_code=403, detail="Invalid token")
 
@@ -301,31 +582,40 @@ async def add_reaction(data: dict, token: str = Query(...), db: Session = Depend
     if not message_id or not reaction_name:
         raise HTTPException(status_code=400, detail="Message ID and reaction name are required")
 
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db.get(Message, message_id)
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
 
+    if not await membership_cache.is_member(db, message.chat_id, user.id):
+        raise HTTPException(status_code=403, detail="You are not a member of this chat")
+
     # Проверяем существование реакции
-    reaction = db.query(Reaction).filter(Reaction.name == reaction_name).first()
+    reaction = (await db.execute(select(Reaction).where(Reaction.name == reaction_name))).scalars().first()
     if not reaction:
         raise HTTPException(status_code=404, detail="Reaction not found")
 
     # Проверяем, существует ли уже реакция от этого пользователя
-    existing_reaction = db.query(MessageReaction).filter_by(
-        message_id=message_id, user_id=user.id, reaction_id=reaction.id
-    ).first()
+    existing_reaction = (await db.execute(
+        select(MessageReaction).filter_by(
+            message_id=message_id, user_id=user.id, reaction_id=reaction.id
+        )
+    )).scalars().first()
 
     if existing_reaction:
-        db.delete(existing_reaction)  # Удаляем, если реакция уже существует
+        await db.delete(existing_reaction)  # Удаляем, если реакция уже существует
     else:
         new_reaction = MessageReaction(
             message_id=message_id, user_id=user.id, reaction_id=reaction.id
         )
         db.add(new_reaction)
-    db.commit()
+    await db.commit()
 
     # Уведомляем через WebSocket
-    reactions = db.query(MessageReaction).filter(MessageReaction.message_id == message_id).all()
+    reactions = (await db.execute(
+        select(MessageReaction)
+        .where(MessageReaction.message_id == message_id)
+        .options(joinedload(MessageReaction.author), joinedload(MessageReaction.reaction))
+    )).scalars().all()
     reaction_data = [
         {
             "user_id": r.user_id,
@@ -341,7 +631,7 @@ async def add_reaction(data: dict, token: str = Query(...), db: Session = Depend
         "message_id": message_id,
         "reactions": reaction_data,
     }
-    await manager.broadcast(json.dumps(notification), str(message.chat_id))
+    await manager.broadcast(dumps(notification), str(message.chat_id))
 
     return {"detail": "Reaction updated"}
 
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from typing import Optional, Set
+import time
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ChatMember
+
+# Кэш состава чатов: chat_id -> множество user_id. Заполняется лениво при первой проверке,
+# website сбрасывает запись при изменении состава; TTL страхует от потерянной инвалидации.
+
+
+class MembershipCache:
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, chat_id: int) -> Optional[Set[int]]:
+        entry = self.entries.get(chat_id)
+        if entry is None:
+            return None
+        members, expires_at = entry
+        if expires_at < time.monotonic():
+            del self.entries[chat_id]
+            return None
+        self.entries.move_to_end(chat_id)
+        return members
+
+    async def get_members(self, db: AsyncSession, chat_id: int) -> Set[int]:
+        members = self._get(chat_id)
+        if members is not None:
+            self.hits += 1
+            return members
+
+        self.misses += 1
+        members = set((await db.execute(
+            select(ChatMember.user_id).where(ChatMember.chat_id == chat_id)
+        )).scalars().all())
+        self.entries[chat_id] = (members, time.monotonic() + self.ttl)
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return members
+
+    async def is_member(self, db: AsyncSession, chat_id: int, user_id: int) -> bool:
+        return user_id in await self.get_members(db, chat_id)
+
+    def invalidate(self, chat_id: int):
+        self.entries.pop(chat_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self) -> dict:
+        return {"cached_chats": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,28 @@
+import os
+
+# Превью изображений: WebP-миниатюры фиксированной ширины лежат рядом с оригиналом
+# в хранилище (static/blobs/ab/cd/<sha256>_w<ширина>.webp), размеры и blurhash — в blobs.
+
+THUMBNAIL_WIDTHS = (320, 640, 1280)
+
+
+def thumbnail_path(path: str, width: int) -> str:
+    base, _ = os.path.splitext(path)
+    return f"{base}_w{width}.webp"
+
+
+def preview_payload(blob):
+    """Данные превью для клиента или None, если изображение ещё не обработано."""
+    if blob is None or blob.width is None:
+        return None
+    return {
+        "width": blob.width,
+        "height": blob.height,
+        "blurhash": blob.blurhash,
+        # Миниатюры шире оригинала не создаются
+        "thumbnails": {
+            str(width): thumbnail_path(blob.path, width)
+            for width in THUMBNAIL_WIDTHS
+            if width < blob.width
+        },
+    }
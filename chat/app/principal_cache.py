@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+import threading
+import time
+
+# Кэш данных текущего пользователя по id: аутентификация без обращения к БД.
+# Записи живут ограниченное время (TTL) и вытесняются по LRU.
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    email: str
+    role: str
+    profile_picture: Optional[str]
+    description: Optional[str]
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            role=user.role,
+            profile_picture=user.profile_picture,
+            description=user.description,
+        )
+
+
+class PrincipalCache:
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return principal
+
+    def set(self, principal: Principal):
+        with self.lock:
+            self.entries[principal.id] = (principal, time.monotonic() + self.ttl)
+            self.entries.move_to_end(principal.id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,67 @@
+from typing import Awaitable, Callable, Dict
+import asyncio
+
+# Отметки о прочтении копятся по комнате короткое окно и уходят одной пачкой:
+# одно UPDATE курсоров и один кадр read_receipts вместо кадра и commit на каждое сообщение.
+
+FlushHandler = Callable[[int, Dict[int, int]], Awaitable[None]]
+
+
+class ReadReceiptBuffer:
+    """Буфер курсоров прочтения по чатам: {chat_id: {user_id: last_read_message_id}}."""
+
+    def __init__(self, flush: FlushHandler, window_ms: int):
+        self.flush_handler = flush
+        self.window = window_ms / 1000
+        self.pending: Dict[int, Dict[int, int]] = {}
+        self.timers: Dict[int, asyncio.Task] = {}
+        # Метрики: сообщения, запрошенные сдвиги курсоров (раньше — по кадру на каждый) и фактические сбросы
+        self.messages = 0
+        self.receipts = 0
+        self.flushes = 0
+
+    def note_message(self):
+        self.messages += 1
+
+    def add(self, chat_id: int, cursors: Dict[int, int]):
+        if not cursors:
+            return
+        self.receipts += 1
+        room = self.pending.setdefault(chat_id, {})
+        for user_id, message_id in cursors.items():
+            room[user_id] = max(room.get(user_id, 0), message_id)
+        if chat_id not in self.timers:
+            self.timers[chat_id] = asyncio.create_task(self._flush_later(chat_id))
+
+    async def _flush_later(self, chat_id: int):
+        await asyncio.sleep(self.window)
+        self.timers.pop(chat_id, None)
+        await self._flush(chat_id)
+
+    async def _flush(self, chat_id: int):
+        cursors = self.pending.pop(chat_id, None)
+        if not cursors:
+            return
+        self.flushes += 1
+        try:
+            await self.flush_handler(chat_id, cursors)
+        except Exception as e:
+            print(f"Error flushing read receipts for chat {chat_id}: {e}")
+
+    async def stop(self):
+        # Таймеры отменяем, а накопленное сбрасываем сразу, чтобы не потерять прочтения
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers.clear()
+        for chat_id in list(self.pending):
+            await self._flush(chat_id)
+
+    def get_stats(self):
+        return {
+            "messages": self.messages,
+            "receipts_requested": self.receipts,
+            "receipt_frames_sent": self.flushes,
+            # До буфера каждый запрос был отдельным кадром и commit
+            "receipt_frames_per_message_unbuffered": round(self.receipts / self.messages, 3) if self.messages else 0,
+            "receipt_frames_per_message": round(self.flushes / self.messages, 3) if self.messages else 0,
+        }
@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from urllib.parse import urlencode
+
+# Подписанные ссылки на файлы чатов: HMAC над путём, id чата и сроком действия. Проверка
+# не обращается к БД — доступ к файлу стоит одного вычисления хэша вместо запроса членства.
+# Ключ должен совпадать в website и chat.
+
+# Без ключа по умолчанию: с известным ключом кто угодно подписал бы ссылку на файл любого чата
+FILE_URL_SECRET = os.getenv("FILE_URL_SECRET", "").encode()
+if not FILE_URL_SECRET:
+    raise RuntimeError("FILE_URL_SECRET is not set")
+FILE_URL_TTL = int(os.getenv("FILE_URL_TTL", str(6 * 3600)))  # секунд минимум до истечения
+# Срок округляется вверх до шага: в пределах шага ссылка не меняется и файл берётся из кэша браузера
+FILE_URL_EXPIRY_STEP = 3600
+UPLOAD_TOKEN_TTL = int(os.getenv("UPLOAD_TOKEN_TTL", "3600"))  # секунд на отправку загруженного файла
+
+
+def _signature(path: str, chat_id: int, expires: int) -> str:
+    message = f"{path}\n{chat_id}\n{expires}".encode()
+    digest = hmac.new(FILE_URL_SECRET, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def sign_file_url(path: str, chat_id: int) -> str:
+    """Ссылка на файл чата с подписью и сроком действия (path?chat=..&expires=..&signature=..)."""
+    if not path:
+        return path
+    expires = -(-(int(time.time()) + FILE_URL_TTL) // FILE_URL_EXPIRY_STEP) * FILE_URL_EXPIRY_STEP
+    query = urlencode({"chat": chat_id, "expires": expires, "signature": _signature(path, chat_id, expires)})
+    return f"{path}?{query}"
+
+
+def verify_file_url(path: str, chat_id, expires, signature) -> bool:
+    try:
+        chat_id, expires = int(chat_id), int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_signature(path, chat_id, expires), signature or "")
+
+
+def sign_preview(preview: dict, chat_id: int):
+    """Превью с подписанными ссылками на миниатюры (они лежат рядом с вложением)."""
+    if preview is None:
+        return None
+    return {
+        **preview,
+        "thumbnails": {width: sign_file_url(path, chat_id) for width, path in preview["thumbnails"].items()},
+    }
+
+
+# Токен загрузки: website выдаёт его вместе с путём вложения, chat-сервис принимает сообщение
+# с файлом только от того же пользователя в тот же чат. Иначе увиденный в одном чате путь
+# можно было бы отправить в другой и получить там подписанную ссылку на чужой файл
+def _upload_signature(path: str, chat_id: int, user_id: int, expires: int) -> str:
+    message = f"upload\n{path}\n{chat_id}\n{user_id}\n{expires}".encode()
+    digest = hmac.new(FILE_URL_SECRET, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def sign_upload(path: str, chat_id: int, user_id: int) -> str:
+    expires = int(time.time()) + UPLOAD_TOKEN_TTL
+    return f"{expires}.{_upload_signature(path, chat_id, user_id, expires)}"
+
+
+def verify_upload(token, path: str, chat_id: int, user_id: int) -> bool:
+    try:
+        expires, signature = token.split(".", 1)
+        expires = int(expires)
+    except (AttributeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(_upload_signature(path, chat_id, user_id, expires), signature)
@@ -0,0 +1,128 @@
+from typing import Dict
+from sqlalchemy import select, update, func, or_, and_, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import ChatMember, ChatSummary, Message
+
+# Сводки чатов (chat_summaries) и счётчики непрочитанных (chat_members.unread_count)
+# обновляются в той же транзакции, что и сообщения. Функции не делают commit.
+
+
+def message_preview(message: Message):
+    return "Файл" if message.file_url else message.content
+
+
+async def _upsert_summary(db: AsyncSession, chat_id: int, message, status: str = "unread"):
+    values = {
+        "last_message_id": message.id if message else None,
+        "last_message_preview": message_preview(message) if message else None,
+        "last_sender_id": message.sender_id if message else None,
+        "last_sent_at": message.sent_at if message else None,
+        "last_message_status": status if message else None,
+    }
+    stmt = insert(ChatSummary).values(chat_id=chat_id, **values)
+    await db.execute(stmt.on_conflict_do_update(index_elements=[ChatSummary.chat_id], set_=values))
+
+
+def _counts_as_unread(message: Message) -> bool:
+    # Системные сообщения (sender_id == 0) не считаются непрочитанными
+    return message.sender_id != 0
+
+
+def _unread_count_subquery(last_read_message_id=ChatMember.last_read_message_id):
+    # Подсчёт по диапазону индекса ix_messages_chat_id_id, без флагов в строках messages
+    return (
+        select(func.count(Message.id))
+        .where(
+            Message.chat_id == ChatMember.chat_id,
+            Message.id > last_read_message_id,
+            or_(
+                Message.sender_id.is_(None),
+                and_(Message.sender_id != ChatMember.user_id, Message.sender_id != 0),
+            ),
+        )
+        .scalar_subquery()
+    )
+
+
+async def record_message(db: AsyncSession, message: Message):
+    """Новое сообщение: обновить сводку и увеличить счётчики остальных участников."""
+    await db.flush()
+    await _upsert_summary(db, message.chat_id, message)
+
+    if _counts_as_unread(message):
+        stmt = update(ChatMember).where(ChatMember.chat_id == message.chat_id)
+        if message.sender_id is not None:
+            stmt = stmt.where(ChatMember.user_id != message.sender_id)
+        await db.execute(
+            stmt.values(unread_count=ChatMember.unread_count + 1).execution_options(synchronize_session=False)
+        )
+
+
+async def advance_read_cursors(db: AsyncSession, chat_id: int, cursors: Dict[int, int]) -> Dict[int, int]:
+    """Сдвинуть курсоры прочтения участников одним UPDATE; возвращает те, что действительно сдвинулись."""
+    if not cursors:
+        return {}
+
+    target = case(cursors, value=ChatMember.user_id)
+    advanced = dict((await db.execute(
+        update(ChatMember)
+        .where(
+            ChatMember.chat_id == chat_id,
+            ChatMember.user_id.in_(list(cursors)),
+            ChatMember.last_read_message_id < target,
+        )
+        .values(
+            last_read_message_id=target,
+            unread_count=_unread_count_subquery(target),
+        )
+        .returning(ChatMember.user_id, ChatMember.last_read_message_id)
+        .execution_options(synchronize_session=False)
+    )).all())
+
+    if advanced:
+        # Последнее сообщение прочитано кем-то кроме автора — отметка для списка чатов
+        await db.execute(
+            update(ChatSummary)
+            .where(
+                ChatSummary.chat_id == chat_id,
+                or_(*(
+                    and_(
+                        ChatSummary.last_message_id <= message_id,
+                        ChatSummary.last_sender_id.is_distinct_from(user_id),
+                    )
+                    for user_id, message_id in advanced.items()
+                )),
+            )
+            .values(last_message_status="read")
+            .execution_options(synchronize_session=False)
+        )
+    return advanced
+
+
+async def refresh_chat_summary(db: AsyncSession, chat_id: int):
+    """Пересчитать сводку и счётчики одного чата (после удаления или очистки истории)."""
+    await db.flush()
+    last_message = (await db.execute(
+        select(Message)
+        .where(Message.chat_id == chat_id)
+        .order_by(Message.sent_at.desc(), Message.id.desc())
+        .limit(1)
+    )).scalars().first()
+
+    status = "unread"
+    if last_message:
+        stmt = select(func.max(ChatMember.last_read_message_id)).where(ChatMember.chat_id == chat_id)
+        if last_message.sender_id is not None:
+            stmt = stmt.where(ChatMember.user_id != last_message.sender_id)
+        read_up_to = (await db.execute(stmt)).scalar()
+        if read_up_to is not None and read_up_to >= last_message.id:
+            status = "read"
+    await _upsert_summary(db, chat_id, last_message, status)
+
+    await db.execute(
+        update(ChatMember)
+        .where(ChatMember.chat_id == chat_id)
+        .values(unread_count=_unread_count_subquery())
+        .execution_options(synchronize_session=False)
+    )
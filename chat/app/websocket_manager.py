@@ -1,43 +1,193 @@
 from typing import Dict, List
 from fastapi import WebSocket, WebSocketDisconnect
-import json
+from broker import InMemoryBroker
+from config import SEND_QUEUE_SIZE, SEND_QUEUE_OVERFLOW
+import asyncio
+
+# Изменения состава чатов: payload — chat_id, каждый воркер сбрасывает свой кэш участников
+MEMBERSHIP_CHANNEL = "membership_events"
+# Изменения и удаление пользователей: payload — user_id, каждый воркер сбрасывает кэш пользователя
+PRINCIPALS_CHANNEL = "principal_events"
+
+
+def room_channel(room_name: str) -> str:
+    return f"room_{room_name}"
+
+
+# События списка чатов: канал на пользователя, воркер слушает каналы своих подключённых
+def user_channel(user_id: int) -> str:
+    return f"user_{user_id}"
+
+
+class OutboundQueue:
+    """Очередь исходящих кадров одного сокета, которую разбирает отдельная задача-писатель.
+
+    Медленный клиент не задерживает рассылку остальным: broadcast только кладёт кадр в очередь.
+    При переполнении либо выбрасывается самый старый кадр (drop_oldest),
+    либо клиент отключается (disconnect).
+    """
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.closed = False
+        self.writer = asyncio.create_task(self._write())
+
+    def put(self, message: str):
+        if self.closed:
+            return
+        if self.queue.full():
+            self.manager.frames_dropped += 1
+            if SEND_QUEUE_OVERFLOW == "disconnect":
+                self.manager.slow_consumers_disconnected += 1
+                self.close()
+                asyncio.create_task(self.websocket.close(code=1013))
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    def close(self):
+        self.closed = True
+        self.writer.cancel()
+
+    async def _write(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.websocket.send_text(message)
+            except Exception as e:
+                print(f"Error sending message: {e}")
+                self.closed = True
+                return
+
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, broker=None, membership_cache=None, principal_cache=None):
+        # Сокеты хранятся локально в процессе, доставка между процессами идёт через брокер
+        self.broker = broker or InMemoryBroker()
+        self.membership_cache = membership_cache
+        self.principal_cache = principal_cache
         self.active_connections: Dict[str, List[WebSocket]] = {}
         self.active_users: Dict[str, List[int]] = {}
+        # Соединения для потока событий списка чатов, по пользователю
+        self.user_connections: Dict[int, List[WebSocket]] = {}
+        self.outbound: Dict[WebSocket, OutboundQueue] = {}
+        self.frames_dropped = 0
+        self.slow_consumers_disconnected = 0
+
+    async def start(self):
+        await self.broker.start(self.deliver, self.on_broker_reconnect)
+        await self.broker.subscribe(MEMBERSHIP_CHANNEL)
+        await self.broker.subscribe(PRINCIPALS_CHANNEL)
+
+    async def stop(self):
+        await self.broker.stop()
 
     async def connect(self, websocket: WebSocket, room_name: str, user_id: int):
         if room_name not in self.active_connections:
             self.active_connections[room_name] = []
+            await self.broker.subscribe(room_channel(room_name))
         if room_name not in self.active_users:
             self.active_users[room_name] = []
 
         self.active_connections[room_name].append(websocket)
+        self.outbound[websocket] = OutboundQueue(websocket, self)
         if user_id not in self.active_users[room_name]:
             self.active_users[room_name].append(user_id)
 
-    def disconnect(self, websocket: WebSocket, room_name: str, user_id: int):
-        if room_name in self.active_connections:
+    async def disconnect(self, websocket: WebSocket, room_name: str, user_id: int):
+        # Повторный вызов для того же сокета ничего не делает
+        self._close_outbound(websocket)
+        if websocket in self.active_connections.get(room_name, []):
             self.active_connections[room_name].remove(websocket)
             if not self.active_connections[room_name]:
                 del self.active_connections[room_name]
+                await self.broker.unsubscribe(room_channel(room_name))
 
-        if room_name in self.active_users:
+        if user_id in self.active_users.get(room_name, []):
             self.active_users[room_name].remove(user_id)
             if not self.active_users[room_name]:
                 del self.active_users[room_name]
 
     async def broadcast(self, message: str, room_name: str):
-        if room_name in self.active_connections:
-            for connection in self.active_connections[room_name]:
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    print(f"Error sending message: {e}")
+        await self.broker.publish(room_channel(room_name), message)
+
+    async def invalidate_membership(self, chat_id: int):
+        await self.broker.publish(MEMBERSHIP_CHANNEL, str(chat_id))
+
+    async def invalidate_principal(self, user_id: int):
+        await self.broker.publish(PRINCIPALS_CHANNEL, str(user_id))
+
+    async def on_broker_reconnect(self):
+        # Инвалидации за время обрыва потеряны — сбрасываем кэши целиком
+        if self.membership_cache:
+            self.membership_cache.clear()
+        if self.principal_cache:
+            self.principal_cache.clear()
+
+    async def deliver(self, channel: str, message: str):
+        # Вызывается брокером: отправляем сообщение сокетам этого процесса
+        if channel.startswith(user_channel("")):
+            user_id = int(channel[len(user_channel("")):])
+            await self._send_local(self.user_connections.get(user_id, []), message)
+        elif channel == MEMBERSHIP_CHANNEL:
+            if self.membership_cache:
+                self.membership_cache.invalidate(int(message))
+        elif channel == PRINCIPALS_CHANNEL:
+            if self.principal_cache:
+                self.principal_cache.invalidate(int(message))
+        else:
+            room_name = channel[len(room_channel("")):]
+            await self._send_local(self.active_connections.get(room_name, []), message)
+
+    async def _send_local(self, connections: List[WebSocket], message: str):
+        for connection in connections:
+            outbound = self.outbound.get(connection)
+            if outbound:
+                outbound.put(message)
+
+    def _close_outbound(self, websocket: WebSocket):
+        outbound = self.outbound.pop(websocket, None)
+        if outbound:
+            outbound.close()
+
+    def get_queue_stats(self) -> dict:
+        depths = [outbound.queue.qsize() for outbound in self.outbound.values()]
+        return {
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "frames_dropped": self.frames_dropped,
+            "slow_consumers_disconnected": self.slow_consumers_disconnected,
+        }
 
     def get_active_users(self, room_name: str) -> List[int]:
         return self.active_users.get(room_name, [])
 
+    def count_connections(self) -> int:
+        return (
+            sum(len(connections) for connections in self.active_connections.values())
+            + sum(len(connections) for connections in self.user_connections.values())
+        )
+
+    async def connect_user(self, websocket: WebSocket, user_id: int):
+        if user_id not in self.user_connections:
+            self.user_connections[user_id] = []
+            await self.broker.subscribe(user_channel(user_id))
+        self.user_connections[user_id].append(websocket)
+        self.outbound[websocket] = OutboundQueue(websocket, self)
+
+    async def disconnect_user(self, websocket: WebSocket, user_id: int):
+        self._close_outbound(websocket)
+        if websocket in self.user_connections.get(user_id, []):
+            self.user_connections[user_id].remove(websocket)
+            if not self.user_connections[user_id]:
+                del self.user_connections[user_id]
+                await self.broker.unsubscribe(user_channel(user_id))
 
+    async def send_to_users(self, messages: Dict[int, str]):
+        # Небольшое событие в канал каждого пользователя; получат только воркеры с его сокетами
+        await self.broker.publish_many([(user_channel(user_id), message) for user_id, message in messages.items()])
 
+    async def send_to_user(self, message: str, user_id: int):
+        await self.send_to_users({user_id: message})
@@ -4,6 +4,9 @@ import ChatPopup from "./ChatPopup";
 import ReactionButton from "./ReactionButton";
 import "./Static/ChatWindow.css";
 
+// Отметки о прочтении отправляются не чаще одного раза за этот интервал
+const READ_RECEIPT_DELAY_MS = 500;
+
 const ChatWindow = ({ chatId, chatName, chatType }) => {
   const [messages, setMessages] = useState([]);
   const [newMessage, setNewMessage] = useState("");
@@ -23,8 +26,14 @@ const ChatWindow = ({ chatId, chatName, chatType }) => {
   const [showDeletePopup, setShowDeletePopup] = useState(false);
   const [selectedMessageId, setSelectedMessageId] = useState(null);
   const [popupPosition, setPopupPosition] = useState({ x: 0, y: 0 }); // Для позиционирования
+  const [nextCursor, setNextCursor] = useState(null); // Курсор для подгрузки старых сообщений
   const messagesEndRef = useRef(null); // Ссылка для прокрутки вниз
+  const isLoadingOlderRef = useRef(false); // Не прокручиваем вниз при подгрузке истории
   const inputRef = useRef(null);
+  const readSentUpToRef = useRef(0); // Новейшее сообщение, о прочтении которого уже сообщили
+  const readPendingRef = useRef(null); // Отметка, ждущая отправки: { ws, messageId }
+  const readTimerRef = useRef(null);
+  const newestMessageIdRef = useRef(0); // Новейшее загруженное сообщение (для onopen)
 
   useEffect(() => {
     // Фокусируемся на поле ввода при открытии чата
@@ -33,11 +42,69 @@ const ChatWindow = ({ chatId, chatName, chatType }) => {
 
   useEffect(() => {
     // Автоматически прокручиваем вниз при обновлении сообщений
+    if (isLoadingOlderRef.current) {
+      isLoadingOlderRef.current = false;
+      return;
+    }
     if (messagesEndRef.current) {
       messagesEndRef.current.scrollIntoView({ behavior: 'smooth' });
     }
   }, [messages]); // Прокручиваем при добавлении новых сообщений
 
+  // Подгрузка более старых сообщений при прокрутке к началу истории
+  const loadOlderMessages = async () => {
+    if (!nextCursor || isLoadingOlderRef.current) return;
+    isLoadingOlderRef.current = true;
+    try {
+      const response = await fetch(
+        `/api/chats/${chatId}/messages/?before=${encodeURIComponent(nextCursor)}`,
+        {
+          headers: {
+            Authorization: `Bearer ${localStorage.getItem("access_token")}`,
+          },
+        }
+      );
+      if (!response.ok) throw new Error("Failed to fetch messages");
+      const data = await response.json();
+      setMessages((prev) => [...data.messages, ...prev]);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      isLoadingOlderRef.current = false;
+      console.error("Failed to fetch older messages:", error);
+    }
+  };
+
+  // Каждый кадр read_receipts — запрос к БД на сервере, поэтому отметки копятся
+  // READ_RECEIPT_DELAY_MS и уходят, только если новейшее видимое сообщение новее отмеченного
+  const queueReadReceipt = (ws, messageId) => {
+    if (!ws || !messageId || messageId <= readSentUpToRef.current) return;
+    const pendingId = readPendingRef.current ? readPendingRef.current.messageId : 0;
+    readPendingRef.current = { ws, messageId: Math.max(messageId, pendingId) };
+    if (readTimerRef.current) return;
+    readTimerRef.current = setTimeout(() => {
+      readTimerRef.current = null;
+      const pending = readPendingRef.current;
+      readPendingRef.current = null;
+      // Сокет ещё не открыт — отметку повторит onopen
+      if (!pending || pending.messageId <= readSentUpToRef.current || pending.ws.readyState !== WebSocket.OPEN) return;
+      readSentUpToRef.current = pending.messageId;
+      pending.ws.send(
+        JSON.stringify({ type: "read_receipts", chat_id: chatId, last_read_message_id: pending.messageId })
+      );
+    }, READ_RECEIPT_DELAY_MS);
+  };
+
+  const handleMessagesScroll = (e) => {
+    const { scrollTop, scrollHeight, clientHeight } = e.target;
+    if (scrollTop === 0) {
+      loadOlderMessages();
+    }
+    // Долистали до конца — отмечаем прочитанным новейшее сообщение
+    if (scrollHeight - scrollTop - clientHeight < 20 && messages.length > 0) {
+      queueReadReceipt(socket, messages[messages.length - 1].id);
+    }
+  };
+
   const handleKeyPress = (e) => {
     // Отправка сообщения по пробелу или Enter
     if (e.key === 'Enter') {
@@ -74,6 +141,8 @@ const uploadFile = async (file) => {
       socket.send(
         JSON.stringify({
           file_url: fileUrl,
+          upload_token: data.upload_token,
+          file_name: data.file_name,
         })
       );
     }
@@ -450,6 +519,9 @@ const leaveChat = async () => {
   useEffect(() => {
   if (!chatId) return;
 
+  readSentUpToRef.current = 0;
+  newestMessageIdRef.current = 0;
+
   const fetchMessages = async () => {
     try {
       const response = await fetch(`/api/chats/${chatId}/messages/`, {
@@ -459,7 +531,11 @@ const leaveChat = async () => {
       });
       if (!response.ok) throw new Error("Failed to fetch messages");
       const data = await response.json();
-      setMessages(data);
+      setMessages(data.messages);
+      setNextCursor(data.next_cursor);
+      if (data.messages.length > 0) {
+        newestMessageIdRef.current = data.messages[data.messages.length - 1].id;
+      }
       sendReadReceipts();
     } catch (error) {
       console.error("Failed to fetch messages:", error);
@@ -482,14 +558,7 @@ const leaveChat = async () => {
   };
 
   const sendReadReceipts = () => {
-    if (socket && socket.readyState === WebSocket.OPEN) {
-      socket.send(
-        JSON.stringify({
-          type: "read_receipts",
-          chat_id: chatId
-        })
-      );
-    }
+    queueReadReceipt(ws, newestMessageIdRef.current);
   };
 
   fetchMessages();
@@ -518,11 +587,19 @@ const leaveChat = async () => {
         )
       );
     } else if (message.type === "read_receipts") {
+      // Сообщение прочитано, если курсор кого-то кроме автора дошёл до него
       setMessages((prev) =>
         prev.map((msg) =>
-          message.read_message_ids.includes(msg.id) ? { ...msg, status: "read" } : msg
+          message.readers.some(
+            (reader) => reader.user_id !== msg.sender_id && reader.last_read_message_id >= msg.id
+          )
+            ? { ...msg, status: "read" }
+            : msg
         )
       );
+    } else if (message.type === "error") {
+      // Сервер отклонил кадр (например, сообщение со ссылкой на незагруженный файл)
+      alert(message.detail);
     } else if (message.type === "chat_history_cleared") {
       setMessages([]);
       alert("Chat history has been cleared by the admin.");
@@ -533,6 +610,9 @@ const leaveChat = async () => {
       setMessages((prev) => [...prev, message]);
     } else {
       setMessages((prev) => [...prev, message]);
+      if (message.id) {
+        newestMessageIdRef.current = Math.max(newestMessageIdRef.current, message.id);
+      }
       if (message.author !== currentUsername) {
         sendReadReceipts();
       }
@@ -550,6 +630,9 @@ const leaveChat = async () => {
   setSocket(ws);
 
   return () => {
+    clearTimeout(readTimerRef.current);
+    readTimerRef.current = null;
+    readPendingRef.current = null;
     ws.close();
   };
 }, [chatId]);
@@ -706,7 +789,7 @@ useEffect(() => {
       </div>
     </div>
 
-    <div className="messages">
+    <div className="messages" onScroll={handleMessagesScroll}>
   {messages.length === 0 ? (
     // Если сообщений нет, отображаем текст по центру
     <div className="no-messages">
@@ -772,8 +855,28 @@ useEffect(() => {
                 {msg.content && <span className="message-text">{msg.content}</span>}
                 {msg.file_url && msg.is_image ? (
                       // Если это изображение
+                      // Сначала грузим WebP-миниатюру, оригинал — только если её ещё нет
                       <img
-                        src={`/api/${msg.file_url}`}
+                        src={`/api/${msg.preview?.thumbnails?.["320"] || msg.file_url}`}
+                        srcSet={
+                          msg.preview
+                            ? Object.entries(msg.preview.thumbnails)
+                                .map(([width, path]) => `/api/${path} ${width}w`)
+                                .join(", ") || undefined
+                            : undefined
+                        }
+                        sizes="200px"
+                        width={msg.preview?.width}
+                        height={msg.preview?.height}
+                        loading="lazy"
+                        onError={(e) => {
+                          // Один раз переключаемся на оригинал (подписанная ссылка из file_url)
+                          if (!e.currentTarget.dataset.fallback) {
+                            e.currentTarget.dataset.fallback = "1";
+                            e.currentTarget.srcset = "";
+                            e.currentTarget.src = `/api/${msg.file_url}`;
+                          }
+                        }}
                         alt="Uploaded"
                         className="message-image"
                       />
@@ -67,11 +67,67 @@ const Chats = () => {
     }
   };
 
-  // Эффект для первичной загрузки чатов и их обновления каждые 2 секунды
+  // Применяем событие из потока к списку чатов
+  const applyChatEvent = (event) => {
+    if (event.type === "chat_update") {
+      setChats((prev) => {
+        const update = (list) =>
+          list.map((chat) =>
+            chat.id === event.chat_id
+              ? { ...chat, last_message: event.last_message, unread_count: event.unread_count }
+              : chat
+          );
+        return { personal: update(prev.personal), group: update(prev.group) };
+      });
+    } else if (event.type === "chat_removed") {
+      setChats((prev) => ({
+        personal: prev.personal.filter((chat) => chat.id !== event.chat_id),
+        group: prev.group.filter((chat) => chat.id !== event.chat_id),
+      }));
+    } else if (event.type === "chat_added" || event.type === "chat_renamed") {
+      fetchChats();
+    }
+  };
+
+  // Первичная загрузка чатов, дальше обновления приходят по WebSocket
   useEffect(() => {
+    let ws = null;
+    let reconnectTimer = null;
+    let closed = false;
+
+    const connect = () => {
+      if (!checkTokenValidity()) return;
+
+      ws = new WebSocket(
+        `ws://${window.location.host}/ws/user?token=${localStorage.getItem("access_token")}`
+      );
+
+      // После (пере)подключения синхронизируем список, чтобы не пропустить события
+      ws.onopen = () => fetchChats();
+
+      ws.onmessage = (event) => {
+        try {
+          applyChatEvent(JSON.parse(event.data));
+        } catch (error) {
+          console.error("Error parsing chat list event:", error);
+        }
+      };
+
+      ws.onclose = () => {
+        if (!closed) {
+          reconnectTimer = setTimeout(connect, 3000);
+        }
+      };
+    };
+
     fetchChats();
-    const interval = setInterval(fetchChats, 2000);
-    return () => clearInterval(interval);
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      if (ws) ws.close();
+    };
   }, []);
 
   // Обработка выбора чата
@@ -0,0 +1,30 @@
+"""Add image preview metadata to blobs
+
+Revision ID: 0a6e3c9b7d52
+Revises: f4b8d2e6a913
+Create Date: 2026-10-18 17:48:26.915530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a6e3c9b7d52'
+down_revision: Union[str, None] = 'f4b8d2e6a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('blobs', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('blobs', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('blobs', sa.Column('blurhash', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('blobs', 'blurhash')
+    op.drop_column('blobs', 'height')
+    op.drop_column('blobs', 'width')
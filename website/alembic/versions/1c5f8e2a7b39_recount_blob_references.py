@@ -0,0 +1,44 @@
+"""Recount blob references from messages, avatars and chat photos
+
+Ссылки теперь берутся при создании сообщения, а не при загрузке: пересчитываем счётчики
+по фактическим ссылкам, чтобы неотправленные загрузки ушли в сборщик мусора.
+
+Revision ID: 1c5f8e2a7b39
+Revises: 0a6e3c9b7d52
+Create Date: 2026-10-18 19:02:41.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c5f8e2a7b39'
+down_revision: Union[str, None] = '0a6e3c9b7d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        UPDATE blobs AS b
+        SET ref_count = r.refs,
+            unreferenced_at = CASE
+                WHEN r.refs = 0 THEN COALESCE(b.unreferenced_at, timezone('utc', now()))
+            END
+        FROM (
+            SELECT path,
+                   (SELECT count(*) FROM messages WHERE messages.file_url = blobs.path)
+                   + (SELECT count(*) FROM users WHERE users.profile_picture = blobs.path)
+                   + (SELECT count(*) FROM chats WHERE chats.photo = blobs.path) AS refs
+            FROM blobs
+        ) AS r
+        WHERE r.path = b.path
+    """)
+
+
+def downgrade() -> None:
+    # Пересчитанные счётчики верны и для прежней схемы
+    pass
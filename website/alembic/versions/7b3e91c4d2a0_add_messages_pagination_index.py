@@ -0,0 +1,26 @@
+"""Add messages pagination index
+
+Revision ID: 7b3e91c4d2a0
+Revises: c91bf2cb9d28
+Create Date: 2026-10-18 10:12:31.407215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e91c4d2a0'
+down_revision: Union[str, None] = 'c91bf2cb9d28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_chat_id_sent_at_id', 'messages', ['chat_id', 'sent_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_chat_id_sent_at_id', table_name='messages')
@@ -0,0 +1,55 @@
+"""Add secondary indexes for hot queries
+
+Revision ID: a8d4f7b1c935
+Revises: e5a0c2d8f146
+Create Date: 2026-10-18 13:41:09.562870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d4f7b1c935'
+down_revision: Union[str, None] = 'e5a0c2d8f146'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Дубликаты реакций мешают построить уникальный индекс, оставляем самую раннюю
+    op.execute("""
+        DELETE FROM message_reactions a
+        USING message_reactions b
+        WHERE a.message_id = b.message_id
+          AND a.user_id = b.user_id
+          AND a.reaction_id = b.reaction_id
+          AND a.id > b.id
+    """)
+
+    # CONCURRENTLY не блокирует запись в таблицы, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_sender_id', 'messages', ['sender_id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_messages_chat_id_sender_id_unread', 'messages', ['chat_id', 'sender_id'],
+                        unique=False, postgresql_concurrently=True,
+                        postgresql_where=sa.text("status = 'unread'"))
+        op.create_index('ix_chat_members_user_id_chat_id', 'chat_members', ['user_id', 'chat_id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('uq_message_reactions_message_user_reaction', 'message_reactions',
+                        ['message_id', 'user_id', 'reaction_id'],
+                        unique=True, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('uq_message_reactions_message_user_reaction', table_name='message_reactions',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_chat_members_user_id_chat_id', table_name='chat_members',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_messages_chat_id_sender_id_unread', table_name='messages',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_messages_sender_id', table_name='messages',
+                      postgresql_concurrently=True)
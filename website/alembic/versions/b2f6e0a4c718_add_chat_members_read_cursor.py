@@ -0,0 +1,57 @@
+"""Add per-member read cursor
+
+Revision ID: b2f6e0a4c718
+Revises: a8d4f7b1c935
+Create Date: 2026-10-18 15:02:37.118402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2f6e0a4c718'
+down_revision: Union[str, None] = 'a8d4f7b1c935'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chat_members', sa.Column('last_read_message_id', sa.Integer(), server_default='0', nullable=False))
+
+    # Курсор ставится на последнее сообщение, помеченное прочитанным по старому общему флагу
+    op.execute("""
+        UPDATE chat_members cm
+        SET last_read_message_id = COALESCE((
+            SELECT max(m.id) FROM messages m
+            WHERE m.chat_id = cm.chat_id AND m.status = 'read'
+        ), 0)
+    """)
+    op.execute("""
+        UPDATE chat_members cm
+        SET unread_count = (
+            SELECT count(m.id) FROM messages m
+            WHERE m.chat_id = cm.chat_id
+              AND m.id > cm.last_read_message_id
+              AND (m.sender_id IS NULL OR (m.sender_id <> cm.user_id AND m.sender_id <> 0))
+        )
+    """)
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_chat_id_id', 'messages', ['chat_id', 'id'],
+                        unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_messages_chat_id_sender_id_unread', table_name='messages',
+                      postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_chat_id_sender_id_unread', 'messages', ['chat_id', 'sender_id'],
+                        unique=False, postgresql_concurrently=True,
+                        postgresql_where=sa.text("status = 'unread'"))
+        op.drop_index('ix_messages_chat_id_id', table_name='messages',
+                      postgresql_concurrently=True)
+
+    op.drop_column('chat_members', 'last_read_message_id')
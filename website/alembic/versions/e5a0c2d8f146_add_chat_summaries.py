@@ -0,0 +1,60 @@
+"""Add chat summaries and per-member unread counters
+
+Revision ID: e5a0c2d8f146
+Revises: 7b3e91c4d2a0
+Create Date: 2026-10-18 11:03:52.118604
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a0c2d8f146'
+down_revision: Union[str, None] = '7b3e91c4d2a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('chat_summaries',
+    sa.Column('chat_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=True),
+    sa.Column('last_message_preview', sa.String(), nullable=True),
+    sa.Column('last_sender_id', sa.Integer(), nullable=True),
+    sa.Column('last_sent_at', sa.DateTime(), nullable=True),
+    sa.Column('last_message_status', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['last_sender_id'], ['users.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('chat_id')
+    )
+    op.add_column('chat_members', sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Заполняем сводки для уже существующих данных
+    op.execute("""
+        INSERT INTO chat_summaries (chat_id, last_message_id, last_message_preview,
+                                    last_sender_id, last_sent_at, last_message_status)
+        SELECT DISTINCT ON (chat_id)
+               chat_id, id,
+               CASE WHEN file_url IS NOT NULL THEN 'Файл' ELSE content END,
+               sender_id, sent_at, status
+        FROM messages
+        ORDER BY chat_id, sent_at DESC, id DESC
+    """)
+    op.execute("""
+        UPDATE chat_members SET unread_count = (
+            SELECT count(messages.id) FROM messages
+            WHERE messages.chat_id = chat_members.chat_id
+              AND messages.status = 'unread'
+              AND (messages.sender_id IS NULL
+                   OR (messages.sender_id != chat_members.user_id AND messages.sender_id != 0))
+        )
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('chat_members', 'unread_count')
+    op.drop_table('chat_summaries')
@@ -0,0 +1,39 @@
+"""Add content-addressed blob store
+
+Revision ID: f4b8d2e6a913
+Revises: d7c3a9e5f201
+Create Date: 2026-10-18 17:05:12.640395
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b8d2e6a913'
+down_revision: Union[str, None] = 'd7c3a9e5f201'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('blobs',
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('unreferenced_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('path')
+    )
+    op.create_index('ix_blobs_unreferenced_at', 'blobs', ['unreferenced_at'], unique=False,
+                    postgresql_where=sa.text('ref_count = 0'))
+    op.add_column('messages', sa.Column('file_name', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'file_name')
+    op.drop_index('ix_blobs_unreferenced_at', table_name='blobs')
+    op.drop_table('blobs')
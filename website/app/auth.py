@@ -1,22 +1,27 @@
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Request
 from db import get_db
 from models import User
 from sqlalchemy.orm import Session
+from principal_cache import Principal, PrincipalCache
+from passwords import hash_password, verify_and_update_password
 
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 240
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+PRINCIPAL_CACHE_TTL = 60  # секунд
+PRINCIPAL_CACHE_SIZE = 10000
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+principal_cache = PrincipalCache(ttl=PRINCIPAL_CACHE_TTL, maxsize=PRINCIPAL_CACHE_SIZE)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_password(plain_password, hashed_password):
+    valid, _ = await verify_and_update_password(plain_password, hashed_password)
+    return valid
+
+async def get_password_hash(password):
+    return await hash_password(password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -26,7 +31,7 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+def get_current_user(request: Request, db: Session = Depends(get_db)) -> Principal:
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -36,6 +41,7 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
         # Декодируем токен
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_email = payload.get("sub")
+        user_id = payload.get("uid")
 
         if not user_email:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
@@ -53,10 +59,27 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
-    # Загружаем пользователя из базы данных
-    user = db.query(User).filter(User.email == user_email).first()
+    # Токен содержит id пользователя: при попадании в кэш запрос к БД не нужен
+    if user_id is not None:
+        principal = principal_cache.get(user_id)
+        if principal:
+            return principal
+        user = db.query(User).filter(User.id == user_id).first()
+    else:
+        # Старые токены без uid
+        user = db.query(User).filter(User.email == user_email).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
+    principal = Principal.from_user(user)
+    principal_cache.set(principal)
+    return principal
+
+
+def get_current_db_user(principal: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    # ORM-объект пользователя для обработчиков, которые изменяют его поля
+    user = db.query(User).filter(User.id == principal.id).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
     return user
 
@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta
+import httpx
+from sqlalchemy import delete, func, insert, select
+from db import SessionLocal
+from models import Message
+
+# Нагрузочная проверка GET /chats/: задержка списка чатов по мере роста истории. Между шагами
+# в чат --grow-chat-id добавляются старые сообщения (последнее сообщение чата не меняется),
+# задержка должна оставаться ровной. Добавленные сообщения удаляются в конце.
+# Запуск: docker compose exec website python bench_chats.py --token ... --grow-chat-id 1 --sender-id 1
+
+BENCH_CONTENT = "bench_chats history"
+INSERT_BATCH = 5000
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def grow_history(chat_id, sender_id, count):
+    # Сообщения датируются задним числом, чтобы не стать последними в чате
+    sent_at = datetime.utcnow() - timedelta(days=365)
+    db = SessionLocal()
+    try:
+        for start in range(0, count, INSERT_BATCH):
+            db.execute(insert(Message), [
+                {"chat_id": chat_id, "sender_id": sender_id, "content": BENCH_CONTENT, "sent_at": sent_at}
+                for _ in range(min(INSERT_BATCH, count - start))
+            ])
+            db.commit()
+        return db.execute(select(func.count()).select_from(Message).where(Message.chat_id == chat_id)).scalar()
+    finally:
+        db.close()
+
+
+def drop_history(chat_id, first_id):
+    db = SessionLocal()
+    try:
+        db.execute(delete(Message).where(
+            Message.chat_id == chat_id, Message.id > first_id, Message.content == BENCH_CONTENT
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def last_message_id():
+    db = SessionLocal()
+    try:
+        return db.execute(select(func.coalesce(func.max(Message.id), 0))).scalar()
+    finally:
+        db.close()
+
+
+async def measure(client, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def fetch():
+        async with semaphore:
+            started = time.monotonic()
+            response = await client.get("/chats/", headers={"Authorization": f"Bearer {args.token}"})
+            response.raise_for_status()
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(fetch() for _ in range(args.requests)))
+    return latencies, time.monotonic() - started
+
+
+async def run(args):
+    steps = [int(value) for value in args.steps.split(",")]
+    first_id = last_message_id()
+    added = 0
+    try:
+        async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+            await measure(client, args)  # прогрев пула соединений и кэшей
+            for target in steps:
+                history = grow_history(args.grow_chat_id, args.sender_id, target - added)
+                added = max(added, target)
+                latencies, elapsed = await measure(client, args)
+                print(
+                    f"history {history} messages: {len(latencies) / elapsed:.1f} req/s, "
+                    f"p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {percentile(latencies, 0.95) * 1000:.1f} ms"
+                )
+    finally:
+        if added:
+            drop_history(args.grow_chat_id, first_id)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--grow-chat-id", type=int, required=True, help="чат пользователя, в который добавляется история")
+    parser.add_argument("--sender-id", type=int, required=True, help="автор добавляемых сообщений")
+    parser.add_argument("--steps", default="0,10000,100000", help="размер добавленной истории на каждом шаге")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import json
+import sys
+from sqlalchemy import text
+from db import SessionLocal
+
+# Проверка планов горячих запросов: EXPLAIN каждого запроса должен читать messages,
+# chat_members и message_reactions по ожидаемому индексу, без Seq Scan по этим таблицам.
+# На маленькой базе планировщик честно предпочтёт Seq Scan, поэтому по умолчанию он
+# выключается (enable_seqscan = off): проверяется, что подходящий индекс есть и применим.
+# Запуск: docker compose exec website python bench_indexes.py --chat-id 1 --user-id 1
+
+CHECKED_TABLES = {"messages", "chat_members", "message_reactions"}
+
+HOT_QUERIES = [
+    (
+        "history page",
+        """SELECT id FROM messages WHERE chat_id = :chat_id
+           ORDER BY sent_at DESC, id DESC LIMIT 51""",
+        "ix_messages_chat_id_sent_at_id",
+    ),
+    (
+        "unread count",
+        """SELECT count(m.id) FROM chat_members cm JOIN messages m
+             ON m.chat_id = cm.chat_id AND m.id > cm.last_read_message_id
+           WHERE cm.chat_id = :chat_id AND cm.user_id = :user_id
+             AND (m.sender_id IS NULL OR (m.sender_id <> cm.user_id AND m.sender_id <> 0))""",
+        "ix_messages_chat_id_id",
+    ),
+    (
+        "user's chats",
+        "SELECT chat_id, unread_count FROM chat_members WHERE user_id = :user_id",
+        "ix_chat_members_user_id_chat_id",
+    ),
+    (
+        "page reactions",
+        """SELECT * FROM message_reactions WHERE message_id IN (
+             SELECT id FROM messages WHERE chat_id = :chat_id ORDER BY sent_at DESC, id DESC LIMIT 50)""",
+        "uq_message_reactions_message_user_reaction",
+    ),
+    (
+        "messages by sender",
+        "SELECT id FROM messages WHERE sender_id = :user_id",
+        "ix_messages_sender_id",
+    ),
+]
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def check(db, sql, params, index_name):
+    plan = db.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = list(plan_nodes(plan[0]["Plan"]))
+    problems = [
+        f"Seq Scan on {node['Relation Name']}"
+        for node in nodes
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in CHECKED_TABLES
+    ]
+    used = {node["Index Name"] for node in nodes if "Index Name" in node}
+    if index_name not in used:
+        problems.append(f"{index_name} not used (indexes in plan: {', '.join(sorted(used)) or 'none'})")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True, help="участник чата")
+    parser.add_argument("--allow-seqscan", action="store_true", help="не выключать Seq Scan (для большой базы)")
+    args = parser.parse_args()
+
+    params = {"chat_id": args.chat_id, "user_id": args.user_id}
+    failed = False
+    db = SessionLocal()
+    try:
+        if not args.allow_seqscan:
+            db.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, sql, index_name in HOT_QUERIES:
+            problems = check(db, sql, params, index_name)
+            failed = failed or bool(problems)
+            print(f"{name}: {'ok' if not problems else 'FAIL: ' + '; '.join(problems)}")
+    finally:
+        db.rollback()
+        db.close()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
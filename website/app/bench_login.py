@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+# Нагрузочная проверка /login: пропускная способность и задержки параллельных логинов,
+# а также задержка лёгкого запроса (/users/profile), который выполняется одновременно
+# с ними и не должен ждать bcrypt.
+# Запуск: docker compose exec website python bench_login.py --email ... --password ... --username ...
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def report(name, latencies, elapsed):
+    print(
+        f"{name}: {len(latencies)} requests, {len(latencies) / elapsed:.1f} req/s, "
+        f"p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {percentile(latencies, 0.95) * 1000:.0f} ms"
+    )
+
+
+async def login(client, args, latencies, statuses):
+    started = time.monotonic()
+    response = await client.post("/login", data={"email": args.email, "password": args.password})
+    latencies.append(time.monotonic() - started)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def probe(client, args, latencies, done):
+    # Фоновые лёгкие запросы, пока идут логины
+    while not done.is_set():
+        started = time.monotonic()
+        response = await client.get("/users/profile", params={"username": args.username})
+        response.raise_for_status()
+        latencies.append(time.monotonic() - started)
+        await asyncio.sleep(args.probe_interval)
+
+
+async def run(args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    login_latencies, probe_latencies, statuses = [], [], {}
+    done = asyncio.Event()
+
+    async def limited(client):
+        async with semaphore:
+            await login(client, args, login_latencies, statuses)
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        prober = asyncio.create_task(probe(client, args, probe_latencies, done))
+        started = time.monotonic()
+        await asyncio.gather(*(limited(client) for _ in range(args.count)))
+        elapsed = time.monotonic() - started
+        done.set()
+        await prober
+
+    print(f"{args.count} logins, concurrency {args.concurrency}, statuses {statuses}")
+    report("login", login_latencies, elapsed)
+    if probe_latencies:
+        report("profile during logins", probe_latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--username", required=True, help="пользователь для фоновых запросов профиля")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import sys
+from sqlalchemy import event
+from db import SessionLocal, engine
+from models import Message, MessageReaction, User
+from principal_cache import Principal
+from serialization import loads
+from main import get_chat_messages
+
+# Проверка числа SQL-запросов get_chat_messages: страница истории вместе с реакциями и их
+# авторами читается постоянным числом запросов, сколько бы сообщений в неё ни попало.
+# Чат должен содержать не меньше сообщений, чем самая большая страница, и хотя бы одну реакцию.
+# Запуск: docker compose exec website python bench_message_queries.py --chat-id 1 --user-id 1
+
+# чат, курсоры прочтения, страница с авторами, реакции с авторами, превью вложений
+QUERY_BUDGET = 5
+
+
+def count_queries(args, limit):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db = SessionLocal()
+    try:
+        principal = Principal.from_user(db.query(User).filter(User.id == args.user_id).one())
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            response = get_chat_messages(args.chat_id, before=None, after=None, limit=limit, user=principal, db=db)
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
+    finally:
+        db.close()
+    page = loads(response.body)
+    return len(page["messages"]), sum(len(msg["reactions"]) for msg in page["messages"]), statements
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True, help="участник чата")
+    parser.add_argument("--limits", default="1,10,50,200")
+    parser.add_argument("--verbose", action="store_true", help="печатать сами запросы")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        total = db.query(Message).filter(Message.chat_id == args.chat_id).count()
+        reactions = db.query(MessageReaction).join(Message).filter(Message.chat_id == args.chat_id).count()
+    finally:
+        db.close()
+    print(f"chat {args.chat_id}: {total} messages, {reactions} reactions")
+
+    failed = False
+    for limit in (int(value) for value in args.limits.split(",")):
+        messages, page_reactions, statements = count_queries(args, limit)
+        ok = len(statements) <= QUERY_BUDGET
+        failed = failed or not ok
+        print(f"limit {limit}: {messages} messages, {page_reactions} reactions, "
+              f"{len(statements)} queries {'ok' if ok else f'FAIL (budget {QUERY_BUDGET})'}")
+        if args.verbose:
+            for statement in statements:
+                print("    " + " ".join(statement.split())[:200])
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from serialization import DefaultResponse, dumps, orjson
+
+# Микробенчмарк сериализации: страница истории из 1000 сообщений в том виде, в каком её
+# отдаёт get_chat_messages. Сравниваются кадр WebSocket (json.dumps против dumps) и ответ
+# FastAPI (JSONResponse через jsonable_encoder против DefaultResponse). БД не нужна.
+# Запуск: docker compose exec website python bench_serialization.py
+
+
+def history_page(count, reactions):
+    started = datetime(2026, 1, 1)
+    return {
+        "messages": [
+            {
+                "id": i,
+                "sender_id": i % 7 + 1,
+                "content": f"Сообщение номер {i}: " + "текст " * 12,
+                "file_url": None,
+                "filename": None,
+                "is_image": None,
+                "preview": None,
+                "author": f"user{i % 7 + 1}",
+                "author_avatar": "static/avatars/default.png",
+                "sent_at": (started + timedelta(seconds=i)).isoformat(),
+                "status": "read",
+                "reactions": [
+                    {
+                        "reaction_name": "like",
+                        "user_id": r + 1,
+                        "username": f"user{r + 1}",
+                        "avatar": "static/avatars/default.png",
+                    }
+                    for r in range(reactions)
+                ],
+            }
+            for i in range(count)
+        ],
+        "next_cursor": "MjAyNi0wMS0wMVQwMDowMDowMHwx",
+    }
+
+
+def best_ms(func, repeat, number):
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--reactions", type=int, default=2, help="реакций на сообщение")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    page = history_page(args.messages, args.reactions)
+    print(f"{args.messages} messages, {len(dumps(page)) / 1024:.0f} KB, orjson {'on' if orjson else 'off'}")
+
+    cases = [
+        ("frame: json.dumps", lambda: json.dumps(page)),
+        ("frame: serialization.dumps", lambda: dumps(page)),
+        ("response: JSONResponse(jsonable_encoder)", lambda: JSONResponse(jsonable_encoder(page))),
+        ("response: DefaultResponse", lambda: DefaultResponse(page)),
+    ]
+    results = {name: best_ms(func, args.repeat, args.number) for name, func in cases}
+    for name, elapsed in results.items():
+        print(f"{name}: {elapsed:.2f} ms")
+
+    names = list(results)
+    print(f"frame speedup: {results[names[0]] / results[names[1]]:.1f}x, "
+          f"response speedup: {results[names[2]] / results[names[3]]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import os
+import time
+import httpx
+
+# Нагрузочная проверка /chats/{chat_id}/upload-file/: пропускная способность параллельных
+# загрузок и пиковый RSS процесса сервера (VmHWM из /proc, нужен pid воркера uvicorn).
+# Запуск: docker compose exec website python bench_uploads.py --token ... --chat-id 1 --pid 1
+
+
+def peak_rss_mb(pid):
+    if pid is None:
+        return None
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+async def upload(client, args, payload, index):
+    response = await client.post(
+        f"/chats/{args.chat_id}/upload-file/",
+        files={"file": (f"bench_{index}.bin", payload, "application/octet-stream")},
+        headers={"Authorization": f"Bearer {args.token}"},
+    )
+    response.raise_for_status()
+
+
+async def run(args):
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(client, index):
+        async with semaphore:
+            await upload(client, args, payload, index)
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(limited(client, i) for i in range(args.count)))
+        elapsed = time.monotonic() - started
+
+    total_mb = args.size_mb * args.count
+    print(f"{args.count} uploads x {args.size_mb} MB, concurrency {args.concurrency}")
+    print(f"elapsed: {elapsed:.2f}s, throughput: {total_mb / elapsed:.1f} MB/s, {args.count / elapsed:.2f} uploads/s")
+    rss = peak_rss_mb(args.pid)
+    if rss is not None:
+        print(f"server peak RSS: {rss:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pid", type=int, default=None)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
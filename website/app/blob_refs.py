@@ -0,0 +1,58 @@
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import update, case, func
+from models import Blob
+
+# Счётчики ссылок на файлы хранилища. Ссылка берётся и снимается в той же транзакции, что и
+# строка, которая на файл указывает (сообщение, аватарка, фото чата): откат транзакции
+# откатывает и счётчик. Операторы выполняет вызывающий — синхронной или асинхронной сессией.
+
+BLOBS_PREFIX = "static/blobs/"  # аватарки и фото чатов, отдаются всем
+ATTACHMENTS_PREFIX = "static/attachments/"  # вложения сообщений, только по подписанной ссылке
+STORE_PREFIXES = (BLOBS_PREFIX, ATTACHMENTS_PREFIX)
+
+
+def is_blob(path: str) -> bool:
+    return bool(path) and path.startswith(STORE_PREFIXES)
+
+
+def is_attachment(path: str) -> bool:
+    return bool(path) and path.startswith(ATTACHMENTS_PREFIX)
+
+
+def _blob_counts(paths) -> dict:
+    return dict(Counter(path for path in paths if is_blob(path)))
+
+
+def acquire_statement(*paths):
+    """UPDATE, берущий по ссылке на каждый путь, или None, если файлов хранилища нет.
+
+    Строки blobs создаёт загрузка, поэтому путь без строки (чужой или удалённый файл) не обновится.
+    """
+    counts = _blob_counts(paths)
+    if not counts:
+        return None
+    increment = case(counts, value=Blob.path)
+    return (
+        update(Blob)
+        .where(Blob.path.in_(list(counts)))
+        .values(ref_count=Blob.ref_count + increment, unreferenced_at=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release_statement(*paths):
+    """UPDATE, снимающий по ссылке с каждого пути, или None, если файлов хранилища нет."""
+    counts = _blob_counts(paths)
+    if not counts:
+        return None
+    decrement = case(counts, value=Blob.path)
+    return (
+        update(Blob)
+        .where(Blob.path.in_(list(counts)))
+        .values(
+            ref_count=func.greatest(Blob.ref_count - decrement, 0),
+            unreferenced_at=case((Blob.ref_count <= decrement, datetime.utcnow()), else_=None),
+        )
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import logging
+import os
+import re
+import time
+from fastapi import UploadFile
+from sqlalchemy import select, delete, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from models import Blob, Chat, Message, User
+from uploads import stream_to_temp, discard_temp, UPLOAD_MAX_SIZE
+from previews import THUMBNAIL_WIDTHS, thumbnail_path
+from blob_refs import BLOBS_PREFIX, acquire_statement, release_statement
+
+# Контентно-адресуемое хранилище файлов: содержимое лежит один раз под именем по SHA-256
+# в <префикс>/ab/cd/<sha256>.<ext>, а таблица blobs считает ссылки на него
+# (сообщения, аватарки, фото чатов). Файл удаляет только сборщик мусора.
+# Вложения сообщений лежат отдельно от аватарок (static/attachments/), потому что отдаются
+# только по подписанной ссылке.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BLOBS_TEMP_DIR = os.path.join(APP_DIR, "static", "blobs", ".tmp")
+BLOB_GC_GRACE = int(os.getenv("BLOB_GC_GRACE", "3600"))  # секунд без ссылок до удаления файла
+BLOB_GC_BATCH = 500
+
+logger = logging.getLogger(__name__)
+
+# Файлы до появления хранилища: сборщик мусора удаляет их, когда на них не осталось ссылок
+# в соответствующем столбце. Аватарки и фото чатов — только с именами, которые давала старая
+# загрузка; файлы по умолчанию и прочие общие файлы не удаляются
+LEGACY_SWEEPS = (
+    ("static/files/", None, Message.file_url),
+    ("static/avatars/", re.compile(r"^user_\d+_\d+\."), User.profile_picture),
+    ("static/group_avatars/", re.compile(r"^group_\d+_\d+\."), Chat.photo),
+)
+
+
+@dataclass(frozen=True)
+class StagedUpload:
+    """Загрузка, уже записанная во временный файл, но ещё не помещённая в хранилище."""
+    temp_path: str
+    path: str
+    sha256: str
+    size: int
+
+
+def blob_path(sha256: str, extension: str, prefix: str = BLOBS_PREFIX) -> str:
+    return f"{prefix}{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def _extension(filename: str) -> str:
+    # Расширение нужно только для Content-Type при отдаче, поэтому принимаем лишь безопасные
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if re.fullmatch(r"\.[a-z0-9]{1,10}", extension) else ""
+
+
+async def stage_upload(upload: UploadFile, prefix: str = BLOBS_PREFIX, max_size: int = UPLOAD_MAX_SIZE) -> StagedUpload:
+    """Принять загрузку во временный файл (в цикле событий, без обращения к БД)."""
+    temp_path, size, sha256 = await stream_to_temp(upload, BLOBS_TEMP_DIR, max_size)
+    return StagedUpload(temp_path, blob_path(sha256, _extension(upload.filename), prefix), sha256, size)
+
+
+def _register(db: Session, staged: StagedUpload):
+    # Новая строка появляется без ссылок: ссылку возьмёт сообщение или профиль в своей транзакции,
+    # а неотправленная загрузка уйдёт в сборщик мусора. Для уже хранимого файла без ссылок
+    # отсрочка удаления начинается заново, чтобы его не удалили до отправки сообщения
+    now = datetime.utcnow()
+    stmt = insert(Blob).values(path=staged.path, sha256=staged.sha256, size=staged.size, ref_count=0, unreferenced_at=now)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[Blob.path],
+        set_={"unreferenced_at": case((Blob.ref_count == 0, now), else_=None)},
+    ))
+
+
+def _place(staged: StagedUpload):
+    target = os.path.join(APP_DIR, staged.path)
+    if os.path.exists(target):
+        discard_temp(staged.temp_path)  # Такое содержимое уже хранится
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(staged.temp_path, target)
+
+
+def store_upload(db: Session, staged: StagedUpload) -> str:
+    """Поместить загрузку в хранилище в текущей транзакции (commit делает вызывающий).
+
+    Ссылку не берёт. Синхронная: вызывается из пула потоков. Возвращает путь файла.
+    """
+    try:
+        # Строка blobs заблокирована до commit вызывающего, поэтому сборщик мусора
+        # не удалит файл между проверкой его наличия и commit
+        _register(db, staged)
+        _place(staged)
+    except BaseException:
+        discard_temp(staged.temp_path)
+        raise
+    return staged.path
+
+
+def acquire(db: Session, *paths: str) -> int:
+    """Взять по ссылке на каждый путь в текущей транзакции. Возвращает число найденных файлов."""
+    stmt = acquire_statement(*paths)
+    return db.execute(stmt).rowcount if stmt is not None else 0
+
+
+def release(db: Session, *paths: str):
+    """Снять по одной ссылке с каждого пути в текущей транзакции (commit делает вызывающий).
+
+    Файлы здесь не удаляются: после отката строки ссылались бы на удалённый файл. Файлы
+    хранилища и старые файлы без ссылок удаляет сборщик мусора.
+    """
+    stmt = release_statement(*paths)
+    if stmt is not None:
+        db.execute(stmt)
+
+
+def _remove_file(path: str) -> bool:
+    try:
+        os.remove(os.path.join(APP_DIR, path))
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError:
+        logger.exception("Failed to delete %s", path)
+        return False
+
+
+def _collect_legacy_files(db: Session, grace: int) -> int:
+    # Старый файл удаляется, только когда на него не ссылается ни одна строка
+    cutoff = time.time() - grace
+    removed = 0
+    for prefix, name_pattern, column in LEGACY_SWEEPS:
+        directory = os.path.join(APP_DIR, prefix)
+        if not os.path.isdir(directory):
+            continue
+        candidates = [
+            prefix + name
+            for name in os.listdir(directory)
+            if (name_pattern is None or name_pattern.match(name))
+            and os.path.isfile(os.path.join(directory, name))
+            and os.path.getmtime(os.path.join(directory, name)) < cutoff
+        ]
+        for i in range(0, len(candidates), BLOB_GC_BATCH):
+            batch = candidates[i:i + BLOB_GC_BATCH]
+            referenced = set(db.execute(select(column).where(column.in_(batch))).scalars())
+            removed += sum(_remove_file(path) for path in batch if path not in referenced)
+    db.commit()
+    return removed
+
+
+def collect_garbage(db: Session, grace: int = BLOB_GC_GRACE) -> int:
+    """Удалить файлы без ссылок дольше grace секунд. Возвращает число удалённых файлов."""
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    removed = 0
+    while True:
+        # Строки держим заблокированными, пока удаляем файлы: параллельная загрузка того же
+        # содержимого дождётся commit и запишет файл заново
+        paths = db.execute(
+            select(Blob.path)
+            .where(Blob.ref_count == 0, Blob.unreferenced_at < cutoff)
+            .limit(BLOB_GC_BATCH)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not paths:
+            break
+        for path in paths:
+            # Вместе с файлом удаляются его миниатюры
+            for filepath in [path, *(thumbnail_path(path, width) for width in THUMBNAIL_WIDTHS)]:
+                _remove_file(filepath)
+        db.execute(delete(Blob).where(Blob.path.in_(paths)).execution_options(synchronize_session=False))
+        db.commit()
+        removed += len(paths)
+
+    removed += _collect_legacy_files(db, grace)
+
+    # Временные файлы прерванных загрузок
+    if os.path.isdir(BLOBS_TEMP_DIR):
+        for name in os.listdir(BLOBS_TEMP_DIR):
+            filepath = os.path.join(BLOBS_TEMP_DIR, name)
+            if os.path.getmtime(filepath) < time.time() - grace:
+                os.remove(filepath)
+    return removed
+
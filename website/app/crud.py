@@ -1,6 +1,5 @@
 from sqlalchemy.orm import Session
 from models import User
-from auth import get_password_hash
 
 def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
@@ -9,8 +8,7 @@ def get_user_by_username(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
 
-def create_user(db: Session, email: str, username: str, password: str):
-    hashed_password = get_password_hash(password)
+def create_user(db: Session, email: str, username: str, hashed_password: str):
     user = User(email=email, username=username, hashed_password=hashed_password)
     db.add(user)
     db.commit()
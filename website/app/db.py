@@ -1,18 +1,29 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from db_settings import DATABASE_URL, engine_options, psycopg2_connect_args, backoff_delays
 import time
 
-time.sleep(5)
-
-DATABASE_URL = "postgresql://messly_user:messly@db:5432/messlydb"
-
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, connect_args=psycopg2_connect_args(), **engine_options())
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def wait_for_database():
+    # Пробуем подключиться с экспоненциальной задержкой, пока БД не станет доступна
+    for delay in backoff_delays():
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            return
+        except OperationalError as e:
+            print(f"Database is not ready, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
 def get_db():
     db_session = SessionLocal()
     try:
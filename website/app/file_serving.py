@@ -0,0 +1,132 @@
+import mimetypes
+import os
+import posixpath
+import re
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from blob_refs import ATTACHMENTS_PREFIX, is_blob
+
+# Отдача файлов из static: строгий ETag и immutable-кэш для контентно-адресуемых имён,
+# запросы Range для докачки и передача отдачи nginx через X-Accel-Redirect, чтобы
+# большие файлы не занимали воркеры Python.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")
+FILE_SERVING_MODE = os.getenv("FILE_SERVING_MODE", "python")  # python или nginx
+X_ACCEL_PREFIX = "/protected-static/"  # internal-location nginx, указывающий на static
+FILE_CHUNK_SIZE = 256 * 1024
+
+IMMUTABLE_CACHE = "max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# Вложения сообщений (вместе с миниатюрами) и файлы сообщений до появления хранилища отдаются
+# только по подписанной ссылке. Аватарки и фото чатов в static/blobs/ общедоступны
+SIGNED_PREFIXES = ("static/files/", ATTACHMENTS_PREFIX)
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _resolve(path: str) -> str:
+    # Путь не должен выходить за пределы static
+    full_path = os.path.normpath(os.path.join(APP_DIR, path))
+    if not full_path.startswith(STATIC_DIR + os.sep) or not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return full_path
+
+
+def normalize_static_path(path: str) -> str:
+    """Путь static/... в каноническом виде; пути с "..", "." или "//" отклоняются.
+
+    Иначе static/blobs/../attachments/... прошёл бы мимо проверки подписи,
+    а _resolve отдал бы закрытое вложение.
+    """
+    if posixpath.normpath(path) != path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return path
+
+
+def requires_signature(path: str) -> bool:
+    return path.startswith(SIGNED_PREFIXES)
+
+
+def _etag(path: str, stat: os.stat_result) -> str:
+    if is_blob(path):
+        # Имя в хранилище — хэш содержимого (у миниатюр с суффиксом ширины), это строгий валидатор
+        return f'"{os.path.splitext(os.path.basename(path))[0]}"'
+    return f'W/"{int(stat.st_mtime)}-{stat.st_size}"'
+
+
+def _parse_range(header: str, size: int):
+    """Диапазон (start, end) включительно или None, если заголовок не поддерживается."""
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":
+        # bytes=-N: последние N байт
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _read_range(full_path: str, start: int, end: int):
+    with open(full_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve_file(request: Request, path: str, private: bool = False) -> Response:
+    """Отдать файл static по относительному пути (static/...). Авторизацию проверяет вызывающий.
+
+    private=True для ответов по подписанной ссылке: общие кэши не должны хранить их дольше её срока.
+    """
+    full_path = _resolve(path)
+    stat = os.stat(full_path)
+    etag = _etag(path, stat)
+    media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": ("private, " if private else "public, ") + (IMMUTABLE_CACHE if is_blob(path) else REVALIDATE_CACHE),
+        "Accept-Ranges": "bytes",
+    }
+
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    if FILE_SERVING_MODE == "nginx":
+        # Байты отдаёт nginx (включая Range), Python только проверил доступ. ETag и Cache-Control
+        # ответа сохраняются в отдаче файла (ETag — через add_header в internal-location)
+        relative = os.path.relpath(full_path, STATIC_DIR).replace(os.sep, "/")
+        return Response(headers={**headers, "X-Accel-Redirect": X_ACCEL_PREFIX + relative}, media_type=media_type)
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("range")
+    # If-Range: диапазон отдаём, только если файл не изменился с прошлой загрузки. Сравнение
+    # строгое (RFC 9110): слабый ETag не подтверждает побайтовое совпадение, тогда отдаём файл целиком
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or (not etag.startswith("W/") and if_range.strip() == etag)):
+        byte_range = _parse_range(range_header, size)
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1 if size else 0)
+
+    if request.method == "HEAD" or not size:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(
+        _read_range(full_path, start, end), status_code=status_code, headers=headers, media_type=media_type
+    )
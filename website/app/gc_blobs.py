@@ -0,0 +1,18 @@
+from db import SessionLocal
+from blobs import collect_garbage
+
+# Удаляет из хранилища файлы, на которые не осталось ссылок.
+# Запуск (например, по cron): docker compose exec website python gc_blobs.py
+
+
+def main():
+    db = SessionLocal()
+    try:
+        removed = collect_garbage(db)
+        print(f"Removed {removed} unreferenced blobs")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import random
+import time
+import httpx
+
+# Общий HTTP-клиент для вызовов между сервисами: один пул keep-alive соединений на процесс,
+# таймауты, повторы с джиттером и circuit breaker, чтобы недоступный сервис не держал запросы.
+# Клиент создаётся при старте приложения и закрывается при остановке.
+
+SERVICE_HTTP_TIMEOUT = float(os.getenv("SERVICE_HTTP_TIMEOUT", "5"))  # секунд на запрос
+SERVICE_HTTP_CONNECT_TIMEOUT = float(os.getenv("SERVICE_HTTP_CONNECT_TIMEOUT", "2"))
+SERVICE_HTTP_MAX_CONNECTIONS = int(os.getenv("SERVICE_HTTP_MAX_CONNECTIONS", "50"))
+SERVICE_HTTP_MAX_KEEPALIVE = int(os.getenv("SERVICE_HTTP_MAX_KEEPALIVE", "20"))
+SERVICE_HTTP_RETRIES = int(os.getenv("SERVICE_HTTP_RETRIES", "2"))  # Повторов сверх первой попытки
+SERVICE_HTTP_BACKOFF = 0.1  # секунд, базовая задержка перед повтором
+SERVICE_HTTP_BREAKER_THRESHOLD = int(os.getenv("SERVICE_HTTP_BREAKER_THRESHOLD", "5"))  # Ошибок подряд
+SERVICE_HTTP_BREAKER_RESET = float(os.getenv("SERVICE_HTTP_BREAKER_RESET", "30"))  # секунд в открытом состоянии
+
+# Повторяем только ответы, которые означают временную недоступность
+RETRY_STATUS_CODES = {502, 503, 504}
+# Запросы без побочных эффектов повторяются при любой временной ошибке. Остальные (POST, DELETE)
+# могли уже выполниться на сервере, поэтому их повторяем, только если запрос точно не ушёл
+RETRY_ALL_METHODS = {"GET", "HEAD", "OPTIONS"}
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """Сервис помечен недоступным, запрос не отправлялся."""
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        # После паузы пропускаем пробный запрос (half-open)
+        return time.monotonic() - self.opened_at >= self.reset_after
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class ServiceClient:
+    def __init__(self, base_url: str, headers: dict = None):
+        self.base_url = base_url
+        self.headers = headers
+        self.client: httpx.AsyncClient = None
+        self.breaker = CircuitBreaker(SERVICE_HTTP_BREAKER_THRESHOLD, SERVICE_HTTP_BREAKER_RESET)
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=httpx.Timeout(SERVICE_HTTP_TIMEOUT, connect=SERVICE_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=SERVICE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=SERVICE_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.base_url} is unavailable")
+
+        retry_all = method.upper() in RETRY_ALL_METHODS
+        for attempt in range(SERVICE_HTTP_RETRIES + 1):
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                error = None
+                retryable = retry_all
+            except httpx.TransportError as e:
+                error = e
+                retryable = retry_all or isinstance(e, NOT_SENT_ERRORS)
+
+            if not retryable or attempt == SERVICE_HTTP_RETRIES:
+                break
+            # Экспоненциальная задержка с полным джиттером, чтобы воркеры не повторяли синхронно
+            await asyncio.sleep(random.uniform(0, SERVICE_HTTP_BACKOFF * 2 ** attempt))
+
+        self.breaker.record_failure()
+        if error:
+            raise error
+        return response
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("DELETE", url, **kwargs)
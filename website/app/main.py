@@ -1,8 +1,13 @@
-from fastapi import FastAPI, HTTPException, Depends, Form, File, UploadFile, Query
+from fastapi import FastAPI, HTTPException, Depends, Form, File, UploadFile, Query, BackgroundTasks, Request
 from sqlalchemy.testing.suite.test_reflection import users
 
-from auth import create_access_token, verify_password, get_password_hash, get_current_user
+from auth import create_access_token, get_current_user, get_current_db_user, get_password_hash, principal_cache
+from principal_cache import Principal
+from passwords import verify_and_update_password
+import passwords
 from crud import create_user, get_user_by_email, get_user_by_username
+from pagination import encode_cursor, decode_cursor
+from summaries import record_message, refresh_chat_summary, new_member_read_cursor
 from db import *
 from schemas import Token, UserIn, ChatCreate, AddMemberRequest, RemoveMemberRequest, PersonalChatRequest, \
     UsernameUpdateRequest, UpdateDescriptionRequest, UserProfile, ChatNameUpdate, UserUpdate
@@ -10,18 +15,27 @@ from models import *
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import joinedload
-import requests
-import time
+from http_client import ServiceClient
+from outbox import OutboxDispatcher, enqueue
+from blobs import StagedUpload, stage_upload, store_upload, acquire, release
+from previews import preview_payload
+from thumbnails import inspect_image, generate_thumbnails
+from file_serving import serve_file, normalize_static_path, requires_signature
+from signed_urls import sign_file_url, sign_preview, sign_upload, verify_file_url
+from blob_refs import ATTACHMENTS_PREFIX
+import anyio
 import os
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import subqueryload
+from sqlalchemy.orm import selectinload
+from sqlalchemy import tuple_, and_
 import mimetypes
 from fastapi.responses import JSONResponse
+from serialization import DefaultResponse
+from db_settings import pool_stats
 #uvicorn website.app.main:app --reload
 #uvicorn chat.app.main:app --reload --port 8001
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=DefaultResponse)
 
 origins = [
     "http://localhost:3000",
@@ -36,12 +50,91 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-BASE_DIR =  os.path.dirname(os.path.abspath(__file__))
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
+@app.on_event("startup")
+def startup():
+    wait_for_database()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    passwords.shutdown()
+
+
+# Внутренние эндпоинты chat-сервиса принимают только запросы с общим токеном (без значения по умолчанию)
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN", "")
+if not INTERNAL_API_TOKEN:
+    raise RuntimeError("INTERNAL_API_TOKEN is not set")
+chat_client = ServiceClient("http://chat:8001", headers={"X-Internal-Token": INTERNAL_API_TOKEN})
+outbox_dispatcher = OutboxDispatcher(chat_client, "/internal/outbox-events")
+
+
+@app.on_event("startup")
+async def start_chat_client():
+    await chat_client.start()
+    await outbox_dispatcher.start()
+
+
+@app.on_event("shutdown")
+async def close_chat_client():
+    await outbox_dispatcher.stop()
+    await chat_client.close()
+
+
+# Файлы отдаются через обработчик, а не StaticFiles: ETag/immutable для хранилища, Range
+# и, при FILE_SERVING_MODE=nginx, отдача самим nginx через X-Accel-Redirect
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+def get_static_file(
+    path: str,
+    request: Request,
+    chat: int = Query(None),
+    expires: int = Query(None),
+    signature: str = Query(None),
+):
+    # Доступ к файлам чатов проверяется по подписи ссылки, без запроса членства в БД;
+    # serve_file не выпускает путь за пределы static. Подпись проверяется по каноническому
+    # пути — тому же, что будет отдан
+    path = normalize_static_path(f"static/{path}")
+    if signature is not None:
+        if not verify_file_url(path, chat, expires, signature):
+            raise HTTPException(status_code=403, detail="Invalid or expired file link")
+    elif requires_signature(path):
+        raise HTTPException(status_code=403, detail="File link must be signed")
+    return serve_file(request, path, private=signature is not None)
+
+
+# События для chat-сервиса пишутся в outbox в той же транзакции, что и изменение данных,
+# и доставляются фоновым диспетчером уже после ответа клиенту
+
+# Уведомление пользователей через поток событий списка чатов в chat-сервисе
+def send_user_event(db: Session, user_ids, event):
+    enqueue(db, "user_event", {"user_ids": user_ids, "event": event})
+
+
+# Сброс кэша участников чата в chat-сервисе после изменения состава
+def notify_membership_changed(db: Session, chat_id):
+    enqueue(db, "membership_changed", {"chat_id": chat_id})
+
+
+# Сброс кэша пользователя в chat-сервисе после изменения профиля или удаления
+def notify_principal_changed(db: Session, user_id):
+    enqueue(db, "principal_changed", {"user_id": user_id})
+
+
+# Системное сообщение в чат от имени сервиса
+def send_system_message(db: Session, chat_id, content):
+    enqueue(db, "system_message", {"chat_id": chat_id, "content": content})
 
 
 @app.post("/register")
-def register(user: UserIn, db: Session = Depends(get_db)):
+async def register(user: UserIn, db: Session = Depends(get_db)):
+    # bcrypt ждём в цикле событий (он считается в пуле процессов), а синхронная сессия
+    # работает только в пуле потоков — поток не простаивает, пока считается хэш
+    await anyio.to_thread.run_sync(check_registration, db, user)
+    hashed_password = await get_password_hash(user.password)
+    return await anyio.to_thread.run_sync(register_user, db, user, hashed_password)
+
+
+def check_registration(db: Session, user: UserIn):
     db_user = get_user_by_email(db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -50,8 +143,10 @@ def register(user: UserIn, db: Session = Depends(get_db)):
     if db_user_by_username:
         raise HTTPException(status_code=400, detail="Username already exists")
 
+
+def register_user(db: Session, user: UserIn, hashed_password: str):
     # Создаем пользователя
-    new_user = create_user(db, user.email, user.username, user.password)
+    new_user = create_user(db, user.email, user.username, hashed_password)
 
     # Автоматическое создание чата с Messly
     messly_user = db.query(User).filter(User.id == 100).first()  # Получаем системного пользователя
@@ -73,9 +168,10 @@ def register(user: UserIn, db: Session = Depends(get_db)):
         db.commit()
 
         # Добавляем участников в чат
+        read_cursor = new_member_read_cursor(db, new_chat.id)
         db.add_all([
-            ChatMember(chat_id=new_chat.id, user_id=new_user.id, role="member"),
-            ChatMember(chat_id=new_chat.id, user_id=messly_user.id, role="member"),
+            ChatMember(chat_id=new_chat.id, user_id=new_user.id, role="member", last_read_message_id=read_cursor),
+            ChatMember(chat_id=new_chat.id, user_id=messly_user.id, role="member", last_read_message_id=read_cursor),
         ])
         db.commit()
 
@@ -87,6 +183,7 @@ def register(user: UserIn, db: Session = Depends(get_db)):
             status="read",
         )
         db.add(welcome_message)
+        record_message(db, welcome_message)
         db.commit()
 
         welcome_message = Message(
@@ -97,6 +194,7 @@ def register(user: UserIn, db: Session = Depends(get_db)):
             status="read",
         )
         db.add(welcome_message)
+        record_message(db, welcome_message)
         db.commit()
 
         welcome_message = Message(
@@ -107,26 +205,46 @@ def register(user: UserIn, db: Session = Depends(get_db)):
             status="read",
         )
         db.add(welcome_message)
+        record_message(db, welcome_message)
+
+        # Приветственные сообщения сразу прочитаны новым пользователем
+        db.query(ChatMember).filter_by(chat_id=new_chat.id, user_id=new_user.id).update(
+            {ChatMember.last_read_message_id: welcome_message.id}, synchronize_session=False
+        )
+        refresh_chat_summary(db, new_chat.id)
         db.commit()
 
     return {"message": "User created successfully"}
 
 
 @app.post("/login", response_model=Token)
-def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = get_user_by_email(db, email)
-    if not user or not verify_password(password, user.hashed_password):
+async def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+    # Как и в register: bcrypt ждём без потока, синхронную сессию — в пуле потоков
+    user = await anyio.to_thread.run_sync(get_user_by_email, db, email)
+    if not user:
+        raise HTTPException(status_code=400, detail="Invalid email or password")
+
+    valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=400, detail="Invalid email or password")
 
+    return await anyio.to_thread.run_sync(complete_login, db, user, new_hash)
+
+
+def complete_login(db: Session, user: User, new_hash: str):
+    # Параметры pwd_context изменились — сохраняем хэш с новыми параметрами
+    if new_hash:
+        user.hashed_password = new_hash
+
     user.status = "online"
     db.commit()
 
-    access_token = create_access_token(data={"sub": user.email})
+    access_token = create_access_token(data={"sub": user.email, "uid": user.id, "role": user.role})
     return {"access_token": access_token, "token_type": "bearer", "username": user.username}
 
 
 @app.post("/logout")
-def logout(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def logout(user: User = Depends(get_current_db_user), db: Session = Depends(get_db)):
     # Обновляем статус пользователя на "оффлайн"
     user.status = "offline"
     db.commit()
@@ -134,7 +252,7 @@ def logout(user: User = Depends(get_current_user), db: Session = Depends(get_db)
 
 
 @app.get("/me")
-def get_me(user: User = Depends(get_current_user)):
+def get_me(user: Principal = Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -151,50 +269,32 @@ def get_me(user: User = Depends(get_current_user)):
 
 
 @app.get("/chats/")
-def get_user_chats(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    personal_chats = db.query(Chat).filter(
-        Chat.type == "personal",
-        Chat.members.any(user_id=user.id)
-    ).options(subqueryload(Chat.messages)).all()
-
-    group_chats = db.query(Chat).filter(
-        Chat.type == "group",
-        Chat.members.any(user_id=user.id)
-    ).options(subqueryload(Chat.messages)).all()
+def get_user_chats(user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    # Последнее сообщение и счётчик непрочитанных берутся из денормализованных
+    # chat_summaries и chat_members.unread_count, без обращения к messages
+    rows = db.query(Chat, ChatMember.unread_count).join(
+        ChatMember, and_(ChatMember.chat_id == Chat.id, ChatMember.user_id == user.id)
+    ).filter(
+        Chat.type.in_(["personal", "group"])
+    ).options(
+        joinedload(Chat.summary).joinedload(ChatSummary.last_sender),
+        selectinload(Chat.members).joinedload(ChatMember.user),
+    ).all()
 
     def format_last_message(chat):
-        # Определяем последнее сообщение
-        last_message = (
-            db.query(Message)
-            .filter(Message.chat_id == chat.id)
-            .order_by(Message.sent_at.desc())  # Сортируем по времени отправки (убывающий порядок)
-            .first()
-        )
-
-        if last_message:
-            # Если есть file_url, возвращаем "Файл", иначе используем content
-            content = "Файл" if last_message.file_url else last_message.content
-        else:
-            content = None
+        summary = chat.summary
+        if not summary or summary.last_message_id is None:
+            summary = None
 
         return {
-            "id": last_message.id if last_message else None,
-            "content": content,
-            "sender_id": last_message.sender_id if last_message else None,
-            "sender_name": last_message.author.username if last_message and last_message.author else None,
-            "sent_at": last_message.sent_at if last_message else None,
-            "status": last_message.status if last_message else None,
+            "id": summary.last_message_id if summary else None,
+            "content": summary.last_message_preview if summary else None,
+            "sender_id": summary.last_sender_id if summary else None,
+            "sender_name": summary.last_sender.username if summary and summary.last_sender else None,
+            "sent_at": summary.last_sent_at if summary else None,
+            "status": summary.last_message_status if summary else None,
         }
 
-    def calculate_unread_count(chat):
-        # Подсчитываем только те сообщения, которые:
-        # - Не являются системными (sender_id != 0)
-        # - Не были отправлены текущим пользователем
-        return sum(
-            1 for msg in chat.messages
-            if msg.status == "unread" and msg.sender_id != user.id and msg.sender_id != 0
-        )
-
     def get_member_data(member):
         if member.user:  # Если пользователь существует
             return {
@@ -218,9 +318,9 @@ def get_user_chats(user: User = Depends(get_current_user), db: Session = Depends
                 "is_personal": True,
                 "members": [get_member_data(member) for member in chat.members],
                 "last_message": format_last_message(chat),
-                "unread_count": calculate_unread_count(chat),
+                "unread_count": unread_count,
             }
-            for chat in personal_chats
+            for chat, unread_count in rows if chat.type == "personal"
         ],
         "group": [
             {
@@ -228,28 +328,70 @@ def get_user_chats(user: User = Depends(get_current_user), db: Session = Depends
                 "name": chat.name,
                 "photo": chat.photo or "static/group_avatars/default.png",
                 "last_message": format_last_message(chat),
-                "unread_count": calculate_unread_count(chat),  # Используем функцию для подсчёта
+                "unread_count": unread_count,
             }
-            for chat in group_chats
+            for chat, unread_count in rows if chat.type == "group"
         ],
     }
 
 
 @app.get("/chats/{chat_id}/messages/")
-def get_chat_messages(chat_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_chat_messages(
+    chat_id: int,
+    before: str = Query(None),
+    after: str = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     chat = db.query(Chat).filter(Chat.id == chat_id).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
-    if not db.query(ChatMember).filter_by(chat_id=chat_id, user_id=user.id).first():
+    # Курсоры прочтения участников: статус сообщения считается по ним, а не по флагу в messages
+    read_cursors = dict(
+        db.query(ChatMember.user_id, ChatMember.last_read_message_id).filter(ChatMember.chat_id == chat_id).all()
+    )
+    if user.id not in read_cursors:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    messages = db.query(Message).filter(Message.chat_id == chat_id).options(
-        joinedload(Message.author)
-    ).order_by(Message.sent_at).all()
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
+    # Keyset-пагинация по (sent_at, id): страница читается по индексу
+    # ix_messages_chat_id_sent_at_id без OFFSET и без загрузки всей истории
+    # Реакции всей страницы грузятся одним IN-запросом вместе с их авторами
+    query = db.query(Message).filter(Message.chat_id == chat_id).options(
+        joinedload(Message.author),
+        selectinload(Message.reactions).joinedload(MessageReaction.reaction),
+        selectinload(Message.reactions).joinedload(MessageReaction.author),
+    )
+    key = tuple_(Message.sent_at, Message.id)
+
+    if after:
+        query = query.filter(key > tuple_(*decode_cursor(after)))
+        page = query.order_by(Message.sent_at, Message.id).limit(limit + 1).all()
+        has_more = len(page) > limit
+        messages = page[:limit]
+    else:
+        # По умолчанию отдаём самые свежие сообщения
+        if before:
+            query = query.filter(key < tuple_(*decode_cursor(before)))
+        page = query.order_by(Message.sent_at.desc(), Message.id.desc()).limit(limit + 1).all()
+        has_more = len(page) > limit
+        messages = list(reversed(page[:limit]))
+
+    # Курсор для продолжения в том же направлении
+    next_cursor = None
+    if has_more and messages:
+        edge = messages[-1] if after else messages[0]
+        next_cursor = encode_cursor(edge.sent_at, edge.id)
+
+    # Превью изображений страницы одним запросом
+    file_urls = {msg.file_url for msg in messages if msg.file_url}
+    blobs = {blob.path: blob for blob in db.query(Blob).filter(Blob.path.in_(file_urls))} if file_urls else {}
 
     def format_reactions(msg):
-        reactions = db.query(MessageReaction).filter(MessageReaction.message_id == msg.id).all()
         return [
             {
                 "reaction_name": r.reaction.name,
@@ -257,30 +399,43 @@ def get_chat_messages(chat_id: int, user: User = Depends(get_current_user), db:
                 "username": r.author.username,
                 "avatar": r.author.profile_picture or "static/avatars/default.png",
             }
-            for r in reactions
+            for r in msg.reactions
         ]
 
-    return [
+    # Достаточно двух самых дальних курсоров: автор сообщения исключается из проверки
+    top_cursors = sorted(read_cursors.items(), key=lambda item: item[1], reverse=True)[:2]
+
+    def read_status(msg):
+        read_up_to = next((last_read for member_id, last_read in top_cursors if member_id != msg.sender_id), 0)
+        return "read" if read_up_to >= msg.id else "unread"
+
+    formatted_messages = [
         {
             "id": msg.id,
+            "sender_id": msg.sender_id,
             "content": msg.content,
-            "file_url": msg.file_url if msg.file_url else None,
-            "filename": os.path.basename(msg.file_url).split("_", 3)[-1] if msg.file_url else None,
+            # Клиент получает только подписанные ссылки на вложение и его миниатюры
+            "file_url": sign_file_url(msg.file_url, chat_id) if msg.file_url else None,
+            "filename": (msg.file_name or os.path.basename(msg.file_url).split("_", 3)[-1]) if msg.file_url else None,
             "is_image": msg.file_url and mimetypes.guess_type(msg.file_url)[0] and mimetypes.guess_type(msg.file_url)[0].startswith('image'),
+            "preview": sign_preview(preview_payload(blobs.get(msg.file_url)), chat_id),
             "author": msg.author.username if msg.author else "Deleted User",
             "author_avatar": msg.author.profile_picture if msg.author else "static/avatars/default.png",
             "sent_at": msg.sent_at.isoformat() if msg.sent_at else None,
-            "status": msg.status,
+            "status": read_status(msg),
             "reactions": format_reactions(msg),
         }
         for msg in messages
     ]
 
+    # Большой ответ отдаём напрямую, минуя jsonable_encoder
+    return DefaultResponse({"messages": formatted_messages, "next_cursor": next_cursor})
+
 
 @app.post("/chats/create")
 def create_chat(
     chat: ChatCreate,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     existing_chat = db.query(Chat).filter(Chat.name == chat.name, Chat.type == "group").first()
@@ -291,7 +446,10 @@ def create_chat(
     db.add(new_chat)
     db.commit()
 
-    chat_member = ChatMember(chat_id=new_chat.id, user_id=user.id, role="admin")
+    chat_member = ChatMember(
+        chat_id=new_chat.id, user_id=user.id, role="admin",
+        last_read_message_id=new_member_read_cursor(db, new_chat.id),
+    )
     db.add(chat_member)
     db.commit()
 
@@ -304,7 +462,7 @@ def create_chat(
 def add_member(
     chat_id: int,
     request: AddMemberRequest,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     # Проверяем существование чата
@@ -327,31 +485,24 @@ def add_member(
     if existing_member:
         raise HTTPException(status_code=400, detail="User is already a member")
 
-    # Добавляем пользователя в чат
-    new_chat_member = ChatMember(chat_id=chat_id, user_id=new_member.id, role="member")
+    # Добавляем пользователя в чат; история до вступления считается прочитанной
+    new_chat_member = ChatMember(
+        chat_id=chat_id, user_id=new_member.id, role="member",
+        last_read_message_id=new_member_read_cursor(db, chat_id),
+    )
     db.add(new_chat_member)
+    notify_membership_changed(db, chat_id)
+    send_system_message(db, chat_id, f"{new_member.username} добавлен в чат.")
+    send_user_event(db, [new_member.id], {"type": "chat_added", "chat_id": chat_id})
     db.commit()
 
-    # Системное сообщение
-    system_message = f"{new_member.username} добавлен в чат."
-
-    # Сохранение сообщения и уведомление через вебсокет
-    try:
-        response = requests.post(
-            "http://chat:8001/ws/send-system-message",
-            json={"chat_id": chat_id, "content": system_message}
-        )
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending system message: {e}")
-
     return {"detail": f"User {request.username} added to the chat"}
 
 
 @app.get("/users/search")
 def search_users(
         username: str,
-        user: User = Depends(get_current_user),
+        user: Principal = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
     users = db.query(User).filter(User.username.ilike(f"%{username}%")).limit(10).all()
@@ -363,7 +514,7 @@ def search_users(
 @app.get("/chats/{chat_id}/role")
 def get_user_role(
         chat_id: int,
-        user: User = Depends(get_current_user),
+        user: Principal = Depends(get_current_user),
         db: Session = Depends(get_db)
 ):
     # Проверяем, существует ли чат
@@ -386,7 +537,7 @@ def get_user_role(
 def remove_member(
     chat_id: int,
     request: RemoveMemberRequest,  # Принимаем тело запроса
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     # Проверка существования чата
@@ -415,25 +566,18 @@ def remove_member(
 
     # Удаление участника
     db.delete(member_to_remove)
+    notify_membership_changed(db, chat_id)
+    send_system_message(db, chat_id, f"{request.username} удалён из чата.")
+    send_user_event(db, [user_to_remove.id], {"type": "chat_removed", "chat_id": chat_id})
     db.commit()
 
-    # Отправка системного сообщения через микросервис вебсокетов
-    try:
-        system_message = f"{request.username} удалён из чата."
-        requests.post(
-            "http://chat:8001/ws/send-system-message",
-            json={"chat_id": chat_id, "content": system_message}
-        )
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending system message: {e}")
-
     return {"detail": f"User {request.username} has been removed from the chat"}
 
 
 @app.delete("/chats/{chat_id}")
 def delete_chat(
     chat_id: int,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     # Проверка существования чата
@@ -446,24 +590,11 @@ def delete_chat(
     if not member or member.role != "admin":
         raise HTTPException(status_code=403, detail="Permission denied")
 
-    messages_with_files = db.query(Message).filter(Message.chat_id == chat_id, Message.file_url != None).all()
-    for message in messages_with_files:
-        file_url = os.path.join(BASE_DIR, message.file_url)
-        if os.path.exists(file_url):
-            try:
-                os.remove(file_url)
-                print(f"Deleted file: {file_url}")
-            except Exception as e:
-                print(f"Error deleting file {file_url}: {str(e)}")
-
-    if chat.photo and chat.photo != "static/group_avatars/default.png":
-        avatar_path = os.path.join(BASE_DIR, chat.photo)
-        if os.path.exists(avatar_path):
-            try:
-                os.remove(avatar_path)
-                print(f"Deleted chat avatar: {avatar_path}")
-            except Exception as e:
-                print(f"Error deleting chat avatar {avatar_path}: {str(e)}")
+    # Снимаем ссылки файлов сообщений и фото чата в той же транзакции, что и удаление
+    file_urls = db.query(Message.file_url).filter(Message.chat_id == chat_id, Message.file_url != None).all()
+    release(db, *(file_url for file_url, in file_urls), chat.photo)
+
+    member_ids = [m.user_id for m in chat.members]
 
     # Удаление всех сообщений чата
     db.query(Message).filter_by(chat_id=chat_id).delete()
@@ -473,6 +604,8 @@ def delete_chat(
 
     # Удаление самого чата
     db.delete(chat)
+    notify_membership_changed(db, chat_id)
+    send_user_event(db, member_ids, {"type": "chat_removed", "chat_id": chat_id})
     db.commit()
 
     return {"detail": f"Chat {chat.name} has been deleted"}
@@ -482,7 +615,7 @@ def delete_chat(
 @app.post("/chats/create_personal")
 def create_personal_chat(
     request: PersonalChatRequest,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     username = request.username
@@ -517,9 +650,11 @@ def create_personal_chat(
     db.commit()
 
     # Добавляем обоих пользователей в участники чата
-    chat_member1 = ChatMember(chat_id=new_chat.id, user_id=user.id, role="member")
-    chat_member2 = ChatMember(chat_id=new_chat.id, user_id=other_user.id, role="member")
+    read_cursor = new_member_read_cursor(db, new_chat.id)
+    chat_member1 = ChatMember(chat_id=new_chat.id, user_id=user.id, role="member", last_read_message_id=read_cursor)
+    chat_member2 = ChatMember(chat_id=new_chat.id, user_id=other_user.id, role="member", last_read_message_id=read_cursor)
     db.add_all([chat_member1, chat_member2])
+    send_user_event(db, [other_user.id], {"type": "chat_added", "chat_id": new_chat.id})
     db.commit()
 
     return {
@@ -534,7 +669,7 @@ def create_personal_chat(
 @app.put("/profile/update_username")
 def update_username(
         request: UsernameUpdateRequest,
-        current_user: User = Depends(get_current_user),
+        current_user: User = Depends(get_current_db_user),
         db: Session = Depends(get_db)
 ):
     # Проверяем, существует ли никнейм
@@ -543,8 +678,10 @@ def update_username(
 
     # Обновляем никнейм пользователя
     current_user.username = request.username
+    notify_principal_changed(db, current_user.id)
     db.commit()
     db.refresh(current_user)
+    principal_cache.invalidate(current_user.id)
     return {"message": "Username updated successfully", "username": request.username}
 
 
@@ -552,20 +689,22 @@ def update_username(
 @app.put("/profile/update_description")
 def update_description(
     request: UpdateDescriptionRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: Session = Depends(get_db)
 ):
     if not request.description:
         raise HTTPException(status_code=400, detail="Description cannot be empty")
 
     current_user.description = request.description
+    notify_principal_changed(db, current_user.id)
     db.commit()
     db.refresh(current_user)
+    principal_cache.invalidate(current_user.id)
     return {"message": "Description updated successfully", "description": current_user.description}
 
 
 @app.get("/chats/{chat_id}/members/")
-def get_chat_members(chat_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_chat_members(chat_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     chat = db.query(Chat).filter(Chat.id == chat_id).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
@@ -585,7 +724,7 @@ def get_chat_members(chat_id: int, user: User = Depends(get_current_user), db: S
 
 
 @app.get("/chats/{chat_id}/is_member")
-def is_member(chat_id: int, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def is_member(chat_id: int, db: Session = Depends(get_db), user: Principal = Depends(get_current_user)):
     member = db.query(ChatMember).filter_by(chat_id=chat_id, user_id=user.id).first()
     if member:
         return {"is_member": True}
@@ -596,7 +735,7 @@ def is_member(chat_id: int, db: Session = Depends(get_db), user=Depends(get_curr
 @app.delete("/chats/{chat_id}/leave")
 def leave_chat(
     chat_id: int,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     # Проверяем, существует ли чат
@@ -615,49 +754,41 @@ def leave_chat(
 
     # Удаляем пользователя из чата
     db.delete(member)
+    notify_membership_changed(db, chat_id)
+    send_system_message(db, chat_id, f"{user.username} покинул чат.")
+    send_user_event(db, [user.id], {"type": "chat_removed", "chat_id": chat_id})
     db.commit()
 
-    # Отправка системного сообщения через микросервис вебсокетов
-    try:
-        system_message = f"{user.username} покинул чат."
-        requests.post(
-            "http://chat:8001/ws/send-system-message",
-            json={"chat_id": chat_id, "content": system_message}
-        )
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending system message: {e}")
-
     return {"detail": "You have left the chat"}
 
 
 
 @app.post("/users/upload-avatar/")
-def upload_avatar(
+async def upload_avatar(
     file: UploadFile = File(...),
-    user: User = Depends(get_current_user),
+    user: User = Depends(get_current_db_user),
     db: Session = Depends(get_db),
 ):
     # Проверяем формат файла
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Invalid file type")
 
-    # Создаём уникальное имя для файла
-    filename = f"user_{user.id}_{int(time.time())}.{file.filename.split('.')[-1]}"
-    filepath = os.path.join(BASE_DIR, "static", "avatars", filename)
+    # Загрузка принимается в цикле событий, работа с синхронной сессией — в пуле потоков
+    staged = await stage_upload(file)
+    return await anyio.to_thread.run_sync(save_avatar, db, user, staged)
 
-    # Сохраняем файл
-    with open(filepath, "wb") as f:
-        f.write(file.file.read())
 
-    # Удаляем старую аватарку, если она была
-    if user.profile_picture and "static/avatars/" in user.profile_picture:
-        old_file = os.path.join(BASE_DIR, user.profile_picture)
-        if os.path.exists(old_file):
-            os.remove(old_file)
+def save_avatar(db: Session, user: User, staged: StagedUpload):
+    # Новая аватарка получает ссылку, со старой ссылка снимается — в одной транзакции
+    new_picture = store_upload(db, staged)
+    acquire(db, new_picture)
+    release(db, user.profile_picture)
 
     # Обновляем путь в базе данных
-    user.profile_picture = f"static/avatars/{filename}"
+    user.profile_picture = new_picture
+    notify_principal_changed(db, user.id)
     db.commit()
+    principal_cache.invalidate(user.id)
 
     return {"detail": "Avatar uploaded successfully", "profile_picture": user.profile_picture}
 
@@ -677,41 +808,44 @@ def get_user_profile(username: str, db: Session = Depends(get_db)):
 
 
 @app.post("/chats/{chat_id}/upload-photo/")
-def upload_chat_photo(
+async def upload_chat_photo(
         chat_id: int,
         file: UploadFile = File(...),
-        user: User = Depends(get_current_user),
+        user: Principal = Depends(get_current_user),
         db: Session = Depends(get_db),
 ):
+    # Проверяем формат файла
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid file type")
+
+    # Права проверяются до приёма файла; синхронная сессия — только в пуле потоков
+    await anyio.to_thread.run_sync(get_own_chat, db, chat_id, user.id)
+    staged = await stage_upload(file)
+    return await anyio.to_thread.run_sync(save_chat_photo, db, chat_id, user.id, staged)
+
+
+def get_own_chat(db: Session, chat_id: int, user_id: int) -> Chat:
     # Проверяем, существует ли чат
     chat = db.query(Chat).filter(Chat.id == chat_id).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
     # Проверяем, является ли пользователь создателем чата
-    if chat.creator_id != user.id:
+    if chat.creator_id != user_id:
         raise HTTPException(status_code=403, detail="Only the chat creator can change the photo")
+    return chat
 
-    # Проверяем формат файла
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Invalid file type")
-
-    # Создаём уникальное имя для файла
-    filename = f"group_{chat.id}_{int(time.time())}.{file.filename.split('.')[-1]}"
-    filepath = os.path.join(BASE_DIR, "static", "group_avatars", filename)
 
-    # Сохраняем файл
-    with open(filepath, "wb") as f:
-        f.write(file.file.read())
+def save_chat_photo(db: Session, chat_id: int, user_id: int, staged: StagedUpload):
+    chat = get_own_chat(db, chat_id, user_id)
 
-    # Удаляем старую аватарку, если она не дефолтная
-    if chat.photo and chat.photo != "static/group_avatars/default.png":
-        old_file = os.path.join(BASE_DIR, chat.photo)
-        if os.path.exists(old_file):
-            os.remove(old_file)
+    # Новое фото получает ссылку, со старого ссылка снимается (дефолтное не трогается)
+    new_photo = store_upload(db, staged)
+    acquire(db, new_photo)
+    release(db, chat.photo)
 
     # Обновляем путь в базе данных
-    chat.photo = f"static/group_avatars/{filename}"
+    chat.photo = new_photo
     db.commit()
 
     return {"detail": "Chat photo uploaded successfully", "photo": chat.photo}
@@ -740,7 +874,7 @@ def get_chat_info(chat_id: int, db: Session = Depends(get_db)):
 def update_chat_name(
     chat_id: int,
     chat_update: ChatNameUpdate,
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     chat = db.query(Chat).filter(Chat.id == chat_id).first()
@@ -754,7 +888,13 @@ def update_chat_name(
         raise HTTPException(status_code=400, detail="Chat name cannot be empty")
 
     chat.name = chat_update.new_name.strip()
+    send_user_event(
+        db,
+        [m.user_id for m in chat.members],
+        {"type": "chat_renamed", "chat_id": chat_id, "name": chat.name}
+    )
     db.commit()
+
     return {"detail": "Chat name updated successfully", "name": chat.name}
 
 
@@ -762,59 +902,67 @@ def update_chat_name(
 @app.post("/chats/{chat_id}/upload-file/")
 async def upload_file(
     chat_id: int,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
+    # Файл принимается частями в цикле событий, а синхронная сессия работает только
+    # в пуле потоков, чтобы загрузки не блокировали остальные запросы
+    await anyio.to_thread.run_sync(check_chat_member, db, chat_id, user.id)
+    staged = await stage_upload(file, prefix=ATTACHMENTS_PREFIX)
+    return await anyio.to_thread.run_sync(save_chat_file, db, chat_id, user.id, staged, file.filename, background_tasks)
+
+
+def check_chat_member(db: Session, chat_id: int, user_id: int):
     # Проверяем, существует ли чат
     chat = db.query(Chat).filter(Chat.id == chat_id).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
 
     # Проверяем, что пользователь является членом чата
-    if not db.query(ChatMember).filter_by(chat_id=chat_id, user_id=user.id).first():
+    if not db.query(ChatMember).filter_by(chat_id=chat_id, user_id=user_id).first():
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Создаём уникальное имя для файла
-    filename = f"file_{chat.id}_{int(time.time())}_{file.filename}"
-    filepath = os.path.join(BASE_DIR, "static", "files", filename)
 
-    # Сохраняем файл
+def save_chat_file(db: Session, chat_id: int, user_id: int, staged: StagedUpload, filename: str, background_tasks: BackgroundTasks):
+    # Одинаковое содержимое хранится один раз. Ссылку на файл берёт chat-сервис в транзакции,
+    # создающей сообщение, и снимает при его удалении; неотправленный файл удалит сборщик мусора
     try:
-        # Перемещаем курсор в начало файла перед чтением (решает проблему повторной загрузки)
-        file.file.seek(0)
-
-        # Сохраняем файл на сервер
-        with open(filepath, "wb") as f:
-            f.write(file.file.read())
-        mime_type, _ = mimetypes.guess_type(filepath)
-        is_image = mime_type and mime_type.startswith("image/")
-
-        return {"file_url": f"static/files/{filename}", "is_image": is_image}
+        file_url = store_upload(db, staged)
+        db.commit()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
+    mime_type, _ = mimetypes.guess_type(filename or file_url)
+    is_image = mime_type and mime_type.startswith("image/")
 
+    # Размеры и blurhash нужны уже в кадре сообщения, а миниатюры создаются после ответа.
+    # Повторная загрузка того же содержимого находит всё готовым
+    blob = db.get(Blob, file_url)
+    if is_image and blob.width is None and inspect_image(file_url):
+        db.refresh(blob)
+    if blob.width is not None:
+        background_tasks.add_task(generate_thumbnails, file_url)
 
-
-@app.delete("/delete-file/")
-async def delete_file(file_url: str, user: User = Depends(get_current_user)):
-    filepath = os.path.join(BASE_DIR, file_url)
-
-    if not os.path.exists(filepath):
-        raise HTTPException(status_code=404, detail="File not found")
-
-    try:
-        os.remove(filepath)  # Удаляем файл
-        return {"detail": "File deleted successfully"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error deleting file: {str(e)}")
+    # file_url здесь — ссылка на загрузку для кадра сообщения; скачать файл по ней нельзя,
+    # подписанную ссылку участники получат вместе с сообщением. upload_token привязывает
+    # загрузку к пользователю и чату, без него chat-сервис сообщение не примет
+    return {
+        "file_url": file_url,
+        "upload_token": sign_upload(file_url, chat_id, user_id),
+        "file_name": filename,
+        "is_image": is_image,
+        "preview": sign_preview(preview_payload(blob), chat_id),
+    }
 
 
 
 
 @app.get("/admin-panel")
-def admin_dashboard(user: User = Depends(get_current_user)):
+def admin_dashboard(user: Principal = Depends(get_current_user)):
     # Проверяем, является ли пользователь администратором
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Access denied. Admins only.")
@@ -830,7 +978,7 @@ def admin_dashboard(user: User = Depends(get_current_user)):
 
 @app.get("/admin-panel/users/")
 def get_users_for_admin(
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
     username: str = Query(None),
     email: str = Query(None),
@@ -872,7 +1020,7 @@ def get_users_for_admin(
 def update_user(
     user_id: int,
     user_update: UserUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     if current_user.id != user_id and current_user.role != "admin":
@@ -891,7 +1039,9 @@ def update_user(
     if user_update.role:
         user.role = user_update.role
 
+    notify_principal_changed(db, user.id)
     db.commit()
+    principal_cache.invalidate(user.id)
 
     return {
         "detail": "User updated successfully",
@@ -907,7 +1057,7 @@ def update_user(
 
 
 @app.delete("/users/{user_id}/")
-async def delete_user(user_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_user(user_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Проверяем, что текущий пользователь имеет права на удаление
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="You do not have permission to delete this user")
@@ -917,24 +1067,21 @@ async def delete_user(user_id: int, user: User = Depends(get_current_user), db:
     if not user_to_delete:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Удаляем аватарку пользователя
-    if user_to_delete.profile_picture:
-        avatar_path = os.path.join(BASE_DIR, user_to_delete.profile_picture)
-        try:
-            os.remove(avatar_path)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error deleting avatar: {str(e)}")
+    # Снимаем ссылку с аватарки пользователя
+    release(db, user_to_delete.profile_picture)
 
     # Удаляем пользователя из базы данных
     db.delete(user_to_delete)
+    notify_principal_changed(db, user_id)
     db.commit()
+    principal_cache.invalidate(user_id)
 
     return {"detail": "User deleted successfully"}
 
 
 @app.get("/admin-panel/chats/")
 def get_chats_for_admin(
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     if user.role != "admin":
@@ -942,7 +1089,7 @@ def get_chats_for_admin(
 
     chats = db.query(Chat).all()
 
-    return [{
+    return DefaultResponse([{
         "id": chat.id,
         "name": chat.name,
         "type": chat.type,
@@ -950,12 +1097,12 @@ def get_chats_for_admin(
         "created_at": chat.created_at.isoformat(),
         "members": [{"id": member.user_id, "username": member.user.username} for member in chat.members],
         "messages": [{"id": msg.id, "content": msg.content, "sent_at": msg.sent_at.isoformat()} for msg in chat.messages]
-    } for chat in chats]
+    } for chat in chats])
 
 
 @app.get("/admin-panel/messages/")
 def get_messages_for_admin(
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db),
     chat_id: int = Query(None),
     status: str = Query(None)
@@ -982,9 +1129,17 @@ def get_messages_for_admin(
     } for msg in messages]
 
 
+@app.get("/admin-panel/db-pool/")
+def get_db_pool_stats(user: Principal = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied. Admins only.")
+
+    return pool_stats(engine.pool)
+
+
 @app.get("/admin-panel/statistics/")
 def get_statistics(
-    user: User = Depends(get_current_user),
+    user: Principal = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     if user.role != "admin":
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, ForeignKey, Index, JSON, text
 from sqlalchemy.orm import relationship
 from db import Base
 from datetime import datetime
@@ -35,6 +35,7 @@ class Chat(Base):
 
     members = relationship("ChatMember", back_populates="chat", cascade="all, delete")
     messages = relationship("Message", back_populates="chat", cascade="all, delete")
+    summary = relationship("ChatSummary", back_populates="chat", uselist=False, cascade="all, delete")
 
 
 class Message(Base):
@@ -46,15 +47,24 @@ class Message(Base):
     is_audio = Column(Boolean, default=False)
     duration = Column(Integer)  # Длительность голосового сообщения в секундах
     file_url = Column(String, nullable=True)  # URL на файл
+    file_name = Column(String, nullable=True)  # Исходное имя файла (в хранилище файл назван по хэшу)
     sender_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
     sent_at = Column(DateTime, default=datetime.utcnow)
-    status = Column(String, default="unread")  # Например: read, unread
+    status = Column(String, default="unread")  # Устарело: прочтение хранится в chat_members.last_read_message_id
 
     author = relationship("User", back_populates="messages")
     chat = relationship("Chat", back_populates="messages")
     reactions = relationship("MessageReaction", back_populates="message", cascade="all, delete")
 
+    __table_args__ = (
+        # Для keyset-пагинации истории чата по (sent_at, id)
+        Index("ix_messages_chat_id_sent_at_id", "chat_id", "sent_at", "id"),
+        Index("ix_messages_sender_id", "sender_id"),
+        # Непрочитанные участника — диапазон id > chat_members.last_read_message_id
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+    )
+
 
 class Reaction(Base):
     __tablename__ = "reactions"
@@ -74,10 +84,33 @@ class ChatMember(Base):
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     role = Column(String, nullable=False, default="member")  # admin, moderator, member
     added_at = Column(DateTime, default=datetime.utcnow)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")  # Поддерживается при записи сообщений
+    # Курсор прочтения: все сообщения чата с id <= last_read_message_id прочитаны участником
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default="0")
 
     chat = relationship("Chat", back_populates="members")
     user = relationship("User", back_populates="chat_memberships")
 
+    __table_args__ = (
+        # Первичный ключ (chat_id, user_id) не помогает искать чаты пользователя
+        Index("ix_chat_members_user_id_chat_id", "user_id", "chat_id"),
+    )
+
+
+class ChatSummary(Base):
+    __tablename__ = "chat_summaries"
+
+    # Денормализованная сводка для списка чатов, обновляется вместе с сообщениями
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True)
+    last_message_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    last_message_preview = Column(String, nullable=True)  # Текст или "Файл"
+    last_sender_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    last_sent_at = Column(DateTime, nullable=True)
+    last_message_status = Column(String, nullable=True)
+
+    chat = relationship("Chat", back_populates="summary")
+    last_sender = relationship("User")
+
 
 class MessageReaction(Base):
     __tablename__ = "message_reactions"
@@ -92,6 +125,10 @@ class MessageReaction(Base):
     reaction = relationship("Reaction", back_populates="message_reactions")
     author = relationship("User", back_populates="reactions")
 
+    __table_args__ = (
+        Index("uq_message_reactions_message_user_reaction", "message_id", "user_id", "reaction_id", unique=True),
+    )
+
 class Notification(Base):
     __tablename__ = "notifications"
 
@@ -104,3 +141,39 @@ class Notification(Base):
 
     user = relationship("User", back_populates="notifications")
 
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+
+    # События для chat-сервиса, записываются в одной транзакции с изменением данных
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String, nullable=False)  # system_message, user_event, membership_changed
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    available_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # Раньше не отправлять: аренда и повторы
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_outbox_events_available_at_id", "available_at", "id"),
+    )
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # Контентно-адресуемое хранилище: один файл на содержимое и счётчик ссылок на него
+    path = Column(String, primary_key=True)  # static/blobs/ab/cd/<sha256>.<ext>
+    sha256 = Column(String(64), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, default=datetime.utcnow)
+    unreferenced_at = Column(DateTime, nullable=True)  # Когда исчезла последняя ссылка
+    # Для изображений: размеры и blurhash-заглушка (миниатюры лежат рядом с файлом)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    blurhash = Column(String, nullable=True)
+
+    __table_args__ = (
+        # Кандидаты для сборщика мусора
+        Index("ix_blobs_unreferenced_at", "unreferenced_at", postgresql_where=text("ref_count = 0")),
+    )
@@ -0,0 +1,71 @@
+import os
+import shutil
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert
+from db import SessionLocal
+from models import Blob, Message
+from blob_refs import BLOBS_PREFIX, ATTACHMENTS_PREFIX, acquire_statement, release_statement
+from blobs import APP_DIR
+from previews import THUMBNAIL_WIDTHS, thumbnail_path
+
+# Переносит вложения сообщений, загруженные до разделения хранилища, из static/blobs/
+# в static/attachments/, где они отдаются только по подписанной ссылке. Файл и миниатюры
+# связываются жёсткой ссылкой, старую копию удалит сборщик мусора, когда на неё не останется
+# ссылок (аватарка с тем же содержимым её сохранит). Повторный запуск безопасен.
+# Запуск: docker compose exec website python move_attachments.py
+
+
+def _link(source: str, target: str):
+    source, target = os.path.join(APP_DIR, source), os.path.join(APP_DIR, target)
+    if os.path.exists(target) or not os.path.exists(source):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def move_blob(db, path: str) -> bool:
+    # Строка старого файла заблокирована, пока ссылки сообщений переходят на новый путь
+    blob = db.execute(select(Blob).where(Blob.path == path).with_for_update()).scalar_one_or_none()
+    refs = db.execute(select(func.count()).select_from(Message).where(Message.file_url == path)).scalar()
+    if blob is None or not refs:
+        db.rollback()
+        return False
+
+    new_path = ATTACHMENTS_PREFIX + path[len(BLOBS_PREFIX):]
+    _link(path, new_path)
+    for width in THUMBNAIL_WIDTHS:
+        _link(thumbnail_path(path, width), thumbnail_path(new_path, width))
+
+    db.execute(insert(Blob).values(
+        path=new_path, sha256=blob.sha256, size=blob.size, ref_count=0,
+        width=blob.width, height=blob.height, blurhash=blob.blurhash,
+    ).on_conflict_do_nothing(index_elements=[Blob.path]))
+    db.execute(
+        update(Message)
+        .where(Message.file_url == path)
+        .values(file_url=new_path)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(acquire_statement(*[new_path] * refs))
+    db.execute(release_statement(*[path] * refs))
+    db.commit()
+    return True
+
+
+def main():
+    db = SessionLocal()
+    try:
+        paths = db.execute(
+            select(Message.file_url).where(Message.file_url.startswith(BLOBS_PREFIX)).distinct()
+        ).scalars().all()
+        moved = sum(move_blob(db, path) for path in paths)
+        print(f"Moved {moved} attachments to {ATTACHMENTS_PREFIX}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+import asyncio
+import os
+import anyio
+import httpx
+from sqlalchemy import update, delete, select, event
+from sqlalchemy.orm import Session
+from db import SessionLocal
+from http_client import ServiceClient
+from models import OutboxEvent
+
+# Transactional outbox: события для chat-сервиса пишутся в outbox_events в той же транзакции,
+# что и изменение данных, а фоновый диспетчер отправляет их пачками. Строка удаляется только
+# после успешного ответа, поэтому доставка «хотя бы один раз».
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))  # секунд между опросами без событий
+OUTBOX_LEASE = 30  # секунд, на которые пачка закрепляется за воркером
+OUTBOX_RETRY_DELAY = 1  # секунд до первого повтора, дальше удваивается
+OUTBOX_MAX_RETRY_DELAY = 60
+
+
+def enqueue(db: Session, event_type: str, payload: dict):
+    """Добавить событие в текущую транзакцию; отправится после commit."""
+    db.add(OutboxEvent(event_type=event_type, payload=payload))
+    db.info["outbox_pending"] = True
+
+
+def _claim_batch():
+    # SKIP LOCKED: несколько воркеров website разбирают outbox, не мешая друг другу
+    with SessionLocal() as db:
+        now = datetime.utcnow()
+        ids = (
+            select(OutboxEvent.id)
+            .where(OutboxEvent.available_at <= now)
+            .order_by(OutboxEvent.id)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_(ids.scalar_subquery()))
+            .values(available_at=now + timedelta(seconds=OUTBOX_LEASE), attempts=OutboxEvent.attempts + 1)
+            .returning(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload, OutboxEvent.attempts)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def _delete_batch(ids):
+    with SessionLocal() as db:
+        db.execute(delete(OutboxEvent).where(OutboxEvent.id.in_(ids)).execution_options(synchronize_session=False))
+        db.commit()
+
+
+def _postpone_batch(ids, attempts):
+    delay = min(OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), OUTBOX_MAX_RETRY_DELAY)
+    with SessionLocal() as db:
+        db.execute(
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_(ids))
+            .values(available_at=datetime.utcnow() + timedelta(seconds=delay))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+
+class OutboxDispatcher:
+    def __init__(self, client: ServiceClient, url: str):
+        self.client = client
+        self.url = url
+        self.loop = None
+        self.wakeup: asyncio.Event = None
+        self.task: asyncio.Task = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        # Будим диспетчер сразу после commit транзакции, в которой появились события
+        event.listen(Session, "after_commit", self._after_commit)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        event.remove(Session, "after_commit", self._after_commit)
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def _after_commit(self, session: Session):
+        if session.info.pop("outbox_pending", False):
+            # Commit выполняется в потоке обработчика, а не в цикле событий
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                delivered = await self.dispatch_once()
+            except Exception as e:
+                print(f"Error dispatching outbox events: {e}")
+                delivered = 0
+            if delivered == OUTBOX_BATCH_SIZE:
+                continue  # Очередь не разобрана, берём следующую пачку без паузы
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_once(self) -> int:
+        rows = await anyio.to_thread.run_sync(_claim_batch)
+        if not rows:
+            return 0
+
+        ids = [row.id for row in rows]
+        events = [{"id": row.id, "type": row.event_type, "payload": row.payload} for row in rows]
+        try:
+            response = await self.client.post(self.url, json={"events": events})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"Error delivering outbox events: {e}")
+            await anyio.to_thread.run_sync(_postpone_batch, ids, max(row.attempts for row in rows))
+            return 0
+
+        await anyio.to_thread.run_sync(_delete_batch, ids)
+        return len(rows)
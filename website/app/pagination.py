@@ -0,0 +1,20 @@
+import base64
+from datetime import datetime
+from fastapi import HTTPException
+
+# Курсор — это пара (sent_at, id) последнего отданного сообщения,
+# упакованная в base64, чтобы клиент не разбирал её содержимое.
+
+
+def encode_cursor(sent_at: datetime, message_id: int) -> str:
+    raw = f"{sent_at.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        sent_at, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(sent_at), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
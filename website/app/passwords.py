@@ -0,0 +1,65 @@
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+from fastapi import HTTPException
+from passlib.context import CryptContext
+import multiprocessing
+import os
+import threading
+
+# bcrypt выполняется в отдельном пуле процессов ограниченного размера, чтобы всплеск
+# логинов не занимал общий пул потоков и не отнимал CPU у остальных запросов. Функции
+# асинхронные: обработчик ждёт результат в цикле событий, не держа поток.
+# Модуль намеренно лёгкий: дочерние процессы импортируют только его.
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "16"))  # Ожидающих сверх числа воркеров
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+def _hash(password):
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_HASH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+async def _run(fn, *args):
+    # Очередь переполнена — отказываем сразу, а не копим ждущие запросы
+    if not _slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Server is busy, try again later", headers={"Retry-After": "1"})
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _slots.release()
+
+
+async def hash_password(password):
+    return await _run(_hash, password)
+
+
+async def verify_and_update_password(plain_password, hashed_password):
+    """Возвращает (верен ли пароль, новый хэш или None, если перехэширование не нужно)."""
+    return await _run(_verify_and_update, plain_password, hashed_password)
+
+
+def shutdown():
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
@@ -0,0 +1,19 @@
+from db import SessionLocal
+from summaries import rebuild_chat_summaries
+
+# Пересобирает chat_summaries и chat_members.unread_count по таблице messages.
+# Запуск: docker compose exec website python rebuild_chat_summaries.py
+
+
+def main():
+    db = SessionLocal()
+    try:
+        rebuild_chat_summaries(db)
+        db.commit()
+        print("Chat summaries rebuilt")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
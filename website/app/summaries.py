@@ -0,0 +1,126 @@
+from sqlalchemy import select, func, or_, and_, case
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from models import ChatMember, ChatSummary, Message
+
+# Сводки чатов (chat_summaries) и счётчики непрочитанных (chat_members.unread_count)
+# обновляются в той же транзакции, что и сообщения. Функции не делают commit.
+
+
+def message_preview(message: Message):
+    return "Файл" if message.file_url else message.content
+
+
+def _upsert_summary(db: Session, chat_id: int, message, status: str = "unread"):
+    values = {
+        "last_message_id": message.id if message else None,
+        "last_message_preview": message_preview(message) if message else None,
+        "last_sender_id": message.sender_id if message else None,
+        "last_sent_at": message.sent_at if message else None,
+        "last_message_status": status if message else None,
+    }
+    stmt = insert(ChatSummary).values(chat_id=chat_id, **values)
+    db.execute(stmt.on_conflict_do_update(index_elements=[ChatSummary.chat_id], set_=values))
+
+
+def _counts_as_unread(message: Message) -> bool:
+    # Системные сообщения (sender_id == 0) не считаются непрочитанными
+    return message.sender_id != 0
+
+
+def _unread_count_subquery():
+    # Подсчёт по диапазону индекса ix_messages_chat_id_id, без флагов в строках messages
+    return (
+        select(func.count(Message.id))
+        .where(
+            Message.chat_id == ChatMember.chat_id,
+            Message.id > ChatMember.last_read_message_id,
+            or_(
+                Message.sender_id.is_(None),
+                and_(Message.sender_id != ChatMember.user_id, Message.sender_id != 0),
+            ),
+        )
+        .scalar_subquery()
+    )
+
+
+def _read_by_others():
+    # Сообщение прочитано, если курсор кого-то кроме автора дошёл до него
+    return (
+        select(ChatMember.user_id)
+        .where(
+            ChatMember.chat_id == Message.chat_id,
+            ChatMember.user_id.is_distinct_from(Message.sender_id),
+            ChatMember.last_read_message_id >= Message.id,
+        )
+        .exists()
+    )
+
+
+def new_member_read_cursor(db: Session, chat_id: int) -> int:
+    """Курсор нового участника: история до его вступления не считается непрочитанной."""
+    return db.query(func.max(Message.id)).filter(Message.chat_id == chat_id).scalar() or 0
+
+
+def record_message(db: Session, message: Message):
+    """Новое сообщение: обновить сводку и увеличить счётчики остальных участников."""
+    db.flush()
+    _upsert_summary(db, message.chat_id, message)
+
+    if _counts_as_unread(message):
+        query = db.query(ChatMember).filter(ChatMember.chat_id == message.chat_id)
+        if message.sender_id is not None:
+            query = query.filter(ChatMember.user_id != message.sender_id)
+        query.update({ChatMember.unread_count: ChatMember.unread_count + 1}, synchronize_session=False)
+
+
+def refresh_chat_summary(db: Session, chat_id: int):
+    """Пересчитать сводку и счётчики одного чата (после удаления или очистки истории)."""
+    db.flush()
+    row = (
+        db.query(Message, _read_by_others())
+        .filter(Message.chat_id == chat_id)
+        .order_by(Message.sent_at.desc(), Message.id.desc())
+        .first()
+    )
+    last_message, is_read = row if row else (None, False)
+    _upsert_summary(db, chat_id, last_message, "read" if is_read else "unread")
+
+    db.query(ChatMember).filter(ChatMember.chat_id == chat_id).update(
+        {ChatMember.unread_count: _unread_count_subquery()}, synchronize_session=False
+    )
+
+
+def rebuild_chat_summaries(db: Session):
+    """Полностью пересобрать сводки всех чатов из таблицы messages."""
+    db.query(ChatSummary).delete(synchronize_session=False)
+
+    last_messages = (
+        select(
+            Message.chat_id,
+            Message.id,
+            case((Message.file_url.isnot(None), "Файл"), else_=Message.content),
+            Message.sender_id,
+            Message.sent_at,
+            case((_read_by_others(), "read"), else_="unread"),
+        )
+        .distinct(Message.chat_id)
+        .order_by(Message.chat_id, Message.sent_at.desc(), Message.id.desc())
+    )
+    db.execute(
+        insert(ChatSummary).from_select(
+            [
+                "chat_id",
+                "last_message_id",
+                "last_message_preview",
+                "last_sender_id",
+                "last_sent_at",
+                "last_message_status",
+            ],
+            last_messages,
+        )
+    )
+
+    db.query(ChatMember).update(
+        {ChatMember.unread_count: _unread_count_subquery()}, synchronize_session=False
+    )
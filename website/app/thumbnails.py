@@ -0,0 +1,68 @@
+import os
+import blurhash
+from PIL import Image, ImageOps
+from sqlalchemy import update
+from db import SessionLocal
+from models import Blob
+from previews import THUMBNAIL_WIDTHS, thumbnail_path
+
+# Обработка загруженных изображений: размеры и blurhash считаются сразу после загрузки
+# (по уменьшенной копии, это быстро), а WebP-миниатюры — фоновой задачей после ответа.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+THUMBNAIL_QUALITY = 80
+BLURHASH_SIZE = 64  # Blurhash считается по копии не больше 64x64
+BLURHASH_COMPONENTS = (4, 3)
+EXIF_ORIENTATION = 0x0112
+
+
+def inspect_image(path: str) -> bool:
+    """Записать в blobs размеры и blurhash изображения. Возвращает False, если файл не картинка."""
+    try:
+        with Image.open(os.path.join(APP_DIR, path)) as source:
+            # Размеры берутся из заголовка, без декодирования всего изображения
+            width, height = source.size
+            if source.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+                width, height = height, width
+            # Для JPEG draft декодирует сразу в уменьшенном масштабе
+            source.draft("RGB", (BLURHASH_SIZE, BLURHASH_SIZE))
+            small = ImageOps.exif_transpose(source).convert("RGB")
+            small.thumbnail((BLURHASH_SIZE, BLURHASH_SIZE))
+            hash_ = blurhash.encode(small, *BLURHASH_COMPONENTS)
+    except (OSError, ValueError) as e:
+        print(f"Cannot read image {path}: {e}")
+        return False
+
+    with SessionLocal() as db:
+        db.execute(
+            update(Blob)
+            .where(Blob.path == path)
+            .values(width=width, height=height, blurhash=hash_)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    return True
+
+
+def generate_thumbnails(path: str):
+    """Создать недостающие WebP-миниатюры изображения (запускается в фоне)."""
+    try:
+        with Image.open(os.path.join(APP_DIR, path)) as source:
+            # Учитываем поворот из EXIF, иначе фото с телефона окажутся повёрнутыми
+            image = ImageOps.exif_transpose(source)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            for width in THUMBNAIL_WIDTHS:
+                if width >= image.width:
+                    break
+                target = os.path.join(APP_DIR, thumbnail_path(path, width))
+                # Миниатюры одинакового содержимого уже созданы при первой загрузке
+                if os.path.exists(target):
+                    continue
+                height = max(1, round(image.height * width / image.width))
+                temp_path = f"{target}.part"
+                image.resize((width, height), Image.LANCZOS).save(
+                    temp_path, "WEBP", quality=THUMBNAIL_QUALITY, method=4
+                )
+                os.replace(temp_path, target)
+    except (OSError, ValueError) as e:
+        print(f"Error generating thumbnails for {path}: {e}")
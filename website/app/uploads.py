@@ -0,0 +1,59 @@
+import hashlib
+import os
+import tempfile
+import anyio
+from fastapi import HTTPException, UploadFile
+
+# Сохранение загрузок на диск частями: файл не читается в память целиком, запись идёт
+# в пуле потоков, а на место файл попадает атомарным переименованием временного.
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 МБ
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", str(100 * 1024 * 1024)))  # байт на файл
+
+
+def _open_temp(directory: str):
+    # Временный файл в той же директории, чтобы os.replace не пересекал файловые системы
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload_", suffix=".part")
+    return os.fdopen(fd, "wb"), temp_path
+
+
+def _close(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+def discard_temp(temp_path: str):
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+
+async def stream_to_temp(upload: UploadFile, directory: str, max_size: int = UPLOAD_MAX_SIZE):
+    """Записать загрузку во временный файл в directory, считая SHA-256 по пути.
+
+    Возвращает (temp_path, size, sha256). При превышении max_size — 413.
+    """
+    # Размер известен заранее (multipart уже разобран) — отказываем, не копируя
+    if getattr(upload, "size", None) is not None and upload.size > max_size:
+        raise HTTPException(status_code=413, detail="File is too large")
+
+    await upload.seek(0)
+    f, temp_path = await anyio.to_thread.run_sync(_open_temp, directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(status_code=413, detail="File is too large")
+            digest.update(chunk)
+            await anyio.to_thread.run_sync(f.write, chunk)
+        await anyio.to_thread.run_sync(_close, f)
+    except BaseException:
+        # Синхронно: при отмене запроса await здесь уже не выполнится
+        f.close()
+        discard_temp(temp_path)
+        raise
+    return temp_path, size, digest.hexdigest()
+